@@ -1,8 +1,14 @@
 import os
+import atexit
 import logging
 import asyncio
+import random
 import secrets
+import tempfile
+import threading
 import uuid
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 from functools import wraps
 from typing import Dict, Any, Optional
@@ -11,12 +17,25 @@ from flask import Flask, request, jsonify, render_template, Response, stream_wit
 from flask_cors import CORS
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
+from pymongo import UpdateOne
 from werkzeug.middleware.proxy_fix import ProxyFix
 
 from config import *
-from mongo import api_keys_collection_sync, logs_collection_sync, videos_collection
+from mongo import api_keys_collection_sync, logs_collection_sync, videos_collection, ensure_indexes, command_counter
 from models import APIKey, APILog
+from cache import TTLCache
+from json_provider import init_json_provider
 from youtube_service_simple import youtube_service
+from telegram_service import telegram_service
+from http_client import aclose_async_client, warm_up
+from async_runner import get_background_loop, run_async
+from usage_recorder import usage_recorder
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows; every process runs the startup tasks there
+    fcntl = None
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG if DEBUG else logging.INFO)
@@ -30,6 +49,9 @@ app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
 # Enable CORS
 CORS(app)
 
+# Faster JSON encoding when orjson is available
+init_json_provider(app)
+
 # Initialize rate limiter
 limiter = Limiter(
     get_remote_address,
@@ -39,38 +61,91 @@ limiter = Limiter(
     strategy="fixed-window",
 )
 
+ONE_DAY = timedelta(days=1)
+STARTUP_LOCK_PATH = os.path.join(tempfile.gettempdir(), "youtube_api_startup.lock")
+
+ADMIN_PATH_PREFIXES = ('/admin', '/api/admin')
+
+# Maintenance sweeps run off the request thread, one at a time
+maintenance_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="maintenance")
+maintenance_lock = threading.Lock()
+maintenance_future: Optional[Future] = None
+
+if DEBUG:
+    # Log how many MongoDB commands each admin request issues so N+1 regressions show up
+    @app.before_request
+    def start_mongo_command_count():
+        if request.path.startswith(ADMIN_PATH_PREFIXES):
+            command_counter.start()
+    
+    @app.after_request
+    def log_mongo_command_count(response):
+        if not request.path.startswith(ADMIN_PATH_PREFIXES):
+            return response
+        commands = command_counter.stop()
+        if commands is not None:
+            logger.debug(f"{request.path} issued {len(commands)} MongoDB commands: {', '.join(commands)}")
+        return response
+
 # In-memory fallback for API keys when MongoDB is not available
 fallback_api_keys = {}
 
+# Process-local cache of MongoDB API keys so validation doesn't query MongoDB on every request.
+# Writes from this process update it directly; each entry expires after API_KEY_CACHE_TTL seconds
+# so writes from other workers are picked up on the next lookup.
+api_key_cache = TTLCache(ttl=API_KEY_CACHE_TTL, maxsize=API_KEY_CACHE_SIZE)
+
+# Cached APIKey objects are shared by every request thread; their counters are only read for the
+# limit check and updated under this lock (MongoDB's $inc through usage_recorder stays the record)
+api_key_usage_lock = threading.Lock()
+
+def load_api_key_cache():
+    """Load every API key from MongoDB into the process-local cache"""
+    for key_doc in api_keys_collection_sync.find({}, {"_id": 0}):
+        try:
+            api_key_cache[key_doc["key"]] = APIKey.from_dict(key_doc)
+        except KeyError:
+            continue  # Skip malformed documents
+
+def invalidate_api_key_cache():
+    """Force the next lookups to read API keys from MongoDB"""
+    api_key_cache.clear()
+
+def get_cached_api_key(api_key: str) -> Optional[APIKey]:
+    """Get an API key from the process-local cache, falling back to MongoDB on a miss"""
+    api_key_obj = api_key_cache.get(api_key)
+    if api_key_obj is None:
+        key_doc = api_keys_collection_sync.find_one({"key": api_key})
+        if key_doc:
+            api_key_obj = APIKey.from_dict(key_doc)
+            api_key_cache[api_key] = api_key_obj
+    return api_key_obj
+
 # Initialize default API keys
 def init_default_keys():
     """Initialize default API keys in MongoDB or fallback storage"""
     try:
         if api_keys_collection_sync is not None:
             # MongoDB is available
-            # Check if admin key exists
-            admin_exists = api_keys_collection_sync.find_one({"key": DEFAULT_ADMIN_KEY})
-            if not admin_exists:
-                admin_key = APIKey(
-                    key=DEFAULT_ADMIN_KEY,
-                    name="Admin Key",
-                    is_admin=True,
-                    daily_limit=10000
-                )
-                api_keys_collection_sync.insert_one(admin_key.to_dict())
-                logger.info("Created admin API key in MongoDB")
-            
-            # Check if API request key exists
-            api_exists = api_keys_collection_sync.find_one({"key": DEFAULT_API_KEY})
-            if not api_exists:
-                api_key = APIKey(
-                    key=DEFAULT_API_KEY,
-                    name="API Request Key",
-                    daily_limit=5000,
-                    created_by=DEFAULT_ADMIN_KEY
-                )
-                api_keys_collection_sync.insert_one(api_key.to_dict())
-                logger.info("Created API request key in MongoDB")
+            # Seed the admin and API request keys in one round trip; existing keys are left untouched
+            admin_key = APIKey(
+                key=DEFAULT_ADMIN_KEY,
+                name="Admin Key",
+                is_admin=True,
+                daily_limit=10000
+            )
+            api_key = APIKey(
+                key=DEFAULT_API_KEY,
+                name="API Request Key",
+                daily_limit=5000,
+                created_by=DEFAULT_ADMIN_KEY
+            )
+            result = api_keys_collection_sync.bulk_write([
+                UpdateOne({"key": key.key}, {"$setOnInsert": key.to_dict()}, upsert=True)
+                for key in (admin_key, api_key)
+            ], ordered=False)
+            if result.upserted_count:
+                logger.info(f"Created {result.upserted_count} default API key(s) in MongoDB")
         else:
             # Fallback to in-memory storage
             logger.warning("MongoDB not available, using in-memory API key storage")
@@ -91,26 +166,82 @@ def init_default_keys():
     except Exception as e:
         logger.error(f"Error initializing default keys: {e}")
 
-# Initialize default keys
-init_default_keys()
+@contextmanager
+def startup_lock():
+    """Non-blocking inter-process lock; yields False if another worker already holds it"""
+    if fcntl is None:
+        yield True
+        return
+    
+    with open(STARTUP_LOCK_PATH, "a") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def run_startup_tasks():
+    """Create indexes, seed default keys and warm the API key cache for this worker"""
+    if api_keys_collection_sync is None:
+        init_default_keys()
+        return
+    
+    # Gunicorn imports the app in every worker; only one of them needs to write to MongoDB
+    with startup_lock() as acquired:
+        if acquired:
+            ensure_indexes()
+            init_default_keys()
+        else:
+            logger.info("Another worker is initializing MongoDB, skipping index and key setup")
+    
+    try:
+        load_api_key_cache()
+    except Exception as e:
+        logger.error(f"Error loading API key cache: {e}")
+
+async def warm_up_connections():
+    """Pre-connect to the external API and Telegram on the shared event loop"""
+    await asyncio.gather(
+        warm_up([EXTERNAL_API_BASE]),
+        telegram_service.warm_up()
+    )
+
+# Initialize indexes, default keys and the API key cache
+run_startup_tasks()
+
+# Open the upstream connections in the background; requests don't wait for this
+asyncio.run_coroutine_threadsafe(warm_up_connections(), get_background_loop())
+
+def close_http_client():
+    """Close the background loop's pooled HTTP client while the loop is still running"""
+    try:
+        run_async(aclose_async_client(), timeout=5)
+    except Exception as e:
+        logger.warning(f"Could not close the HTTP client cleanly: {e}")
+
+# atexit runs before daemon threads are stopped, so the background loop can still do the close
+atexit.register(close_http_client)
 
 def validate_api_key(api_key: str) -> Optional[APIKey]:
     """Validate API key and return APIKey object if valid"""
+    now = datetime.now()
     try:
         if api_keys_collection_sync is not None:
             # Try to use MongoDB
             try:
-                key_doc = api_keys_collection_sync.find_one({"key": api_key})
-                if not key_doc:
+                api_key_obj = get_cached_api_key(api_key)
+                if not api_key_obj:
                     # Check fallback if not found in MongoDB
                     if api_key in fallback_api_keys:
                         return fallback_api_keys[api_key]
                     return None
                 
-                api_key_obj = APIKey.from_dict(key_doc)
-                
                 # Auto-expire if needed
-                if api_key_obj.auto_expire_if_needed():
+                if api_key_obj.auto_expire_if_needed(now):
                     try:
                         api_keys_collection_sync.update_one(
                             {"key": api_key},
@@ -121,7 +252,7 @@ def validate_api_key(api_key: str) -> Optional[APIKey]:
                     return None
                 
                 # Auto-reset daily requests at midnight
-                if api_key_obj.auto_reset_if_needed():
+                if api_key_obj.auto_reset_if_needed(now):
                     try:
                         api_keys_collection_sync.update_one(
                             {"key": api_key},
@@ -134,17 +265,17 @@ def validate_api_key(api_key: str) -> Optional[APIKey]:
                         logger.error(f"Error updating reset status: {e}")
                 
                 # Check if expired after auto-check
-                if api_key_obj.is_expired():
+                if api_key_obj.is_expired(now):
                     return None
                 
                 # Check rate limits
-                if api_key_obj.remaining_requests() <= 0:
+                if api_key_obj.remaining_requests(now) <= 0:
                     return None
                 
                 # Legacy support for old count field
-                if datetime.now() > api_key_obj.reset_at:
+                if now > api_key_obj.reset_at:
                     api_key_obj.count = 0
-                    api_key_obj.reset_at = datetime.now() + timedelta(days=1)
+                    api_key_obj.reset_at = now + ONE_DAY
                     try:
                         api_keys_collection_sync.update_one(
                             {"key": api_key},
@@ -165,17 +296,17 @@ def validate_api_key(api_key: str) -> Optional[APIKey]:
         api_key_obj = fallback_api_keys[api_key]
         
         # Check if expired
-        if api_key_obj.is_expired():
+        if api_key_obj.is_expired(now):
             return None
         
         # Check rate limits
-        if api_key_obj.remaining_requests() <= 0:
+        if api_key_obj.remaining_requests(now) <= 0:
             return None
         
         # Reset count if needed
-        if datetime.now() > api_key_obj.reset_at:
+        if now > api_key_obj.reset_at:
             api_key_obj.count = 0
-            api_key_obj.reset_at = datetime.now() + timedelta(days=1)
+            api_key_obj.reset_at = now + ONE_DAY
         
         return api_key_obj
             
@@ -205,20 +336,16 @@ def require_api_key(f):
         if not api_key_obj:
             return jsonify({"error": "Invalid or expired API key"}), 401
         
-        # Increment usage count with new method
+        # Check the daily limit and count this request in one step, so concurrent requests can't
+        # lose increments or all pass the check on the same remaining request
+        with api_key_usage_lock:
+            if api_key_obj.remaining_requests() <= 0:
+                return jsonify({"error": "Invalid or expired API key"}), 401
+            if api_keys_collection_sync is not None or api_key in fallback_api_keys:
+                api_key_obj.increment_requests()
+        
         if api_keys_collection_sync is not None:
-            api_keys_collection_sync.update_one(
-                {"key": api_key},
-                {"$inc": {
-                    "count": 1,
-                    "daily_requests": 1,
-                    "total_requests": 1
-                }}
-            )
-        else:
-            # Update fallback storage
-            if api_key in fallback_api_keys:
-                fallback_api_keys[api_key].increment_requests()
+            usage_recorder.record_usage(api_key, count=1, daily_requests=1, total_requests=1)
         
         # Log API usage
         if logs_collection_sync is not None:
@@ -229,7 +356,7 @@ def require_api_key(f):
                 ip_address=get_remote_address(),
                 response_status=200
             )
-            logs_collection_sync.insert_one(log_entry.to_dict())
+            usage_recorder.record_log(log_entry)
         
         # Store API key in request context
         setattr(request, 'api_key', api_key_obj)
@@ -259,6 +386,41 @@ def require_admin_key(f):
     
     return decorated_function
 
+def video_info_response(result: Dict[str, Any]) -> Response:
+    """JSON response for a video lookup, or 304 when the client already holds the same body"""
+    response = jsonify(result)
+    # Tagged from the serialized body, so any changed field (URL, title, telegram_cached...) changes it
+    response.add_etag()
+    response.cache_control.private = True
+    # Kept short: telegram_service only reuses stored links while this much of their hour is left
+    response.cache_control.max_age = VIDEO_INFO_CLIENT_MAX_AGE
+    return response.make_conditional(request)
+
+def video_lookup_response(video_id: str, stream_type: str, not_found_error: str):
+    """Look up a video and build its response.
+
+    Clients that send Prefer: respond-async get 202 Accepted if the lookup takes longer than
+    ASYNC_LOOKUP_WAIT. The lookup keeps running on the background loop and caches its result,
+    so repeating the request after Retry-After returns it.
+    """
+    lookup = youtube_service.get_video_info(video_id, stream_type)
+    if 'respond-async' in request.headers.get('Prefer', ''):
+        try:
+            result = run_async(lookup, timeout=ASYNC_LOOKUP_WAIT)
+        except FutureTimeoutError:
+            response = jsonify({"status": "pending", "retry_after": ASYNC_LOOKUP_RETRY_AFTER})
+            response.status_code = 202
+            response.headers['Retry-After'] = str(ASYNC_LOOKUP_RETRY_AFTER)
+            response.headers['Preference-Applied'] = 'respond-async'
+            return response
+    else:
+        result = run_async(lookup)
+    
+    if not result:
+        return jsonify({"error": not_found_error}), 404
+    
+    return video_info_response(result)
+
 @app.route('/')
 def index():
     """Home page with API documentation"""
@@ -283,12 +445,7 @@ def youtube_endpoint():
         
         # Get video information
         stream_type = "video" if video else "audio"
-        result = youtube_service.get_video_info(video_id, stream_type)
-        
-        if not result:
-            return jsonify({"error": "Video not found or unavailable"}), 404
-        
-        return jsonify(result)
+        return video_lookup_response(video_id, stream_type, "Video not found or unavailable")
         
     except Exception as e:
         logger.error(f"Error in youtube endpoint: {e}")
@@ -315,13 +472,13 @@ def ytmp4_endpoint():
         
         # Increment usage count
         if api_keys_collection_sync is not None:
-            api_keys_collection_sync.update_one(
-                {"key": key},
-                {"$inc": {"count": 1}}
-            )
+            with api_key_usage_lock:
+                api_key_obj.count += 1
+            usage_recorder.record_usage(key, count=1)
         else:
             if key in fallback_api_keys:
-                fallback_api_keys[key].count += 1
+                with api_key_usage_lock:
+                    fallback_api_keys[key].count += 1
         
         # Log API usage
         if logs_collection_sync is not None:
@@ -332,7 +489,7 @@ def ytmp4_endpoint():
                 ip_address=get_remote_address(),
                 response_status=200
             )
-            logs_collection_sync.insert_one(log_entry.to_dict())
+            usage_recorder.record_log(log_entry)
         
         # Parse video ID from URL
         video_id = youtube_service.parse_video_id(url)
@@ -340,12 +497,7 @@ def ytmp4_endpoint():
             return jsonify({"error": "Invalid YouTube URL"}), 400
         
         # Get video information
-        result = youtube_service.get_video_info(video_id, "video")
-        
-        if not result:
-            return jsonify({"error": "Video not found or unavailable"}), 404
-        
-        return jsonify(result)
+        return video_lookup_response(video_id, "video", "Video not found or unavailable")
         
     except Exception as e:
         logger.error(f"Error in ytmp4 endpoint: {e}")
@@ -372,13 +524,13 @@ def ytmp3_endpoint():
         
         # Increment usage count
         if api_keys_collection_sync is not None:
-            api_keys_collection_sync.update_one(
-                {"key": key},
-                {"$inc": {"count": 1}}
-            )
+            with api_key_usage_lock:
+                api_key_obj.count += 1
+            usage_recorder.record_usage(key, count=1)
         else:
             if key in fallback_api_keys:
-                fallback_api_keys[key].count += 1
+                with api_key_usage_lock:
+                    fallback_api_keys[key].count += 1
         
         # Log API usage
         if logs_collection_sync is not None:
@@ -389,7 +541,7 @@ def ytmp3_endpoint():
                 ip_address=get_remote_address(),
                 response_status=200
             )
-            logs_collection_sync.insert_one(log_entry.to_dict())
+            usage_recorder.record_log(log_entry)
         
         # Parse video ID from URL
         video_id = youtube_service.parse_video_id(url)
@@ -397,24 +549,45 @@ def ytmp3_endpoint():
             return jsonify({"error": "Invalid YouTube URL"}), 400
         
         # Get audio information
-        result = youtube_service.get_video_info(video_id, "audio")
-        
-        if not result:
-            return jsonify({"error": "Audio not found or unavailable"}), 404
-        
-        return jsonify(result)
+        return video_lookup_response(video_id, "audio", "Audio not found or unavailable")
         
     except Exception as e:
         logger.error(f"Error in ytmp3 endpoint: {e}")
         return jsonify({"error": "Internal server error"}), 500
 
 @app.route('/stream/<stream_id>')
+@require_api_key
+@limiter.limit(API_RATE_LIMIT)
 def stream_endpoint(stream_id):
-    """Stream endpoint for media delivery"""
+    """Stream endpoint for media delivery, proxying the video's (or with type=audio, the audio's) media"""
     try:
-        # This would be implemented based on your streaming requirements
-        # For now, return a placeholder
-        return jsonify({"error": "Stream endpoint not implemented"}), 501
+        video_id = youtube_service.parse_video_id(stream_id)
+        if not video_id:
+            return jsonify({"error": "Invalid YouTube URL or video ID"}), 400
+        
+        stream_type = "audio" if request.args.get('type') == 'audio' else "video"
+        result = run_async(youtube_service.get_video_info(video_id, stream_type))
+        if not result or not result.get('url'):
+            return jsonify({"error": "Video not found or unavailable"}), 404
+        
+        # Opened before the response is built so the upstream status and range headers can be forwarded
+        upstream = youtube_service.open_stream(result['url'], request.headers.get('Range'))
+        if upstream is None:
+            return jsonify({"error": "Media stream unavailable"}), 502
+        
+        try:
+            response = Response(
+                stream_with_context(youtube_service.iter_stream(upstream)),
+                status=upstream.status_code,
+                headers=youtube_service.stream_headers(upstream),
+                direct_passthrough=True
+            )
+        except Exception:
+            upstream.close()
+            raise
+        # Also releases the upstream connection when the client goes away before the body is read
+        response.call_on_close(upstream.close)
+        return response
         
     except Exception as e:
         logger.error(f"Error in stream endpoint: {e}")
@@ -479,6 +652,7 @@ def create_api_key():
         
         if api_keys_collection_sync is not None:
             api_keys_collection_sync.insert_one(api_key.to_dict())
+            api_key_cache[new_key] = api_key
         else:
             fallback_api_keys[new_key] = api_key
         
@@ -502,6 +676,7 @@ def delete_api_key(key_id):
     try:
         if api_keys_collection_sync is not None:
             result = api_keys_collection_sync.delete_one({"key": key_id})
+            api_key_cache.pop(key_id, None)
             if result.deleted_count > 0:
                 return jsonify({"message": "API key deleted successfully"})
             else:
@@ -541,33 +716,31 @@ def get_stats():
         logger.error(f"Error getting stats: {e}")
         return jsonify({"error": "Internal server error"}), 500
 
-@app.route('/api/admin/maintenance', methods=['POST'])
-@require_admin_key
-def run_maintenance():
-    """Run maintenance tasks - auto-expire keys and reset daily counters"""
+def _run_maintenance() -> None:
+    """Auto-expire keys and reset daily counters"""
     try:
         expired_count = 0
         reset_count = 0
         
         if api_keys_collection_sync is not None:
+            now = datetime.now()
+            
             # Find all keys
             all_keys = api_keys_collection_sync.find({})
             
             for key_doc in all_keys:
                 api_key_obj = APIKey.from_dict(key_doc)
-                updated = False
                 
                 # Check and auto-expire
-                if api_key_obj.auto_expire_if_needed():
+                if api_key_obj.auto_expire_if_needed(now):
                     api_keys_collection_sync.update_one(
                         {"key": api_key_obj.key},
                         {"$set": {"status": "expired"}}
                     )
                     expired_count += 1
-                    updated = True
                 
                 # Check and auto-reset daily counters
-                if api_key_obj.auto_reset_if_needed():
+                if api_key_obj.auto_reset_if_needed(now):
                     api_keys_collection_sync.update_one(
                         {"key": api_key_obj.key},
                         {"$set": {
@@ -576,18 +749,29 @@ def run_maintenance():
                         }}
                     )
                     reset_count += 1
-                    updated = True
+            
+            invalidate_api_key_cache()
         
-        return jsonify({
-            "status": "success",
-            "expired_keys": expired_count,
-            "reset_counters": reset_count,
-            "timestamp": datetime.now().isoformat()
-        })
+        logger.info(f"Maintenance finished: {expired_count} keys expired, {reset_count} counters reset")
         
     except Exception as e:
         logger.error(f"Error in maintenance: {e}")
-        return jsonify({"error": "Maintenance failed"}), 500
+
+@app.route('/api/admin/maintenance', methods=['POST'])
+@require_admin_key
+def run_maintenance():
+    """Schedule maintenance tasks - auto-expire keys and reset daily counters"""
+    global maintenance_future
+    
+    with maintenance_lock:
+        if maintenance_future is not None and not maintenance_future.done():
+            return jsonify({"status": "already_running"}), 409
+        maintenance_future = maintenance_executor.submit(_run_maintenance)
+    
+    return jsonify({
+        "status": "scheduled",
+        "timestamp": datetime.now().isoformat()
+    }), 202
 
 @app.route('/health')
 def health_check():
@@ -619,20 +803,39 @@ def admin_stats():
         return jsonify({'error': 'Invalid admin key'}), 401
     
     try:
-        from datetime import datetime, timedelta
-        import random
-        
         # Get real stats from MongoDB
         total_requests = 0
         today_requests = 0
+        error_requests = 0
         active_keys = 0
+        today_start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        week_days = [(today_start - timedelta(days=offset)).strftime('%Y-%m-%d') for offset in range(6, -1, -1)]
+        daily_requests = dict.fromkeys(week_days, 0)
         
         if logs_collection_sync is not None:
-            total_requests = logs_collection_sync.count_documents({})
-            today = datetime.now().strftime('%Y-%m-%d')
-            today_requests = logs_collection_sync.count_documents({
-                'timestamp': {'$regex': f'^{today}'}
-            })
+            # One pass over the logs instead of a separate count query per figure
+            facets = next(logs_collection_sync.aggregate([
+                {"$facet": {
+                    "total": [{"$count": "count"}],
+                    "errors": [
+                        {"$match": {"response_status": {"$gte": 400}}},
+                        {"$count": "count"}
+                    ],
+                    "daily": [
+                        {"$match": {"timestamp": {"$gte": today_start - timedelta(days=6)}}},
+                        {"$group": {
+                            "_id": {"$dateToString": {"format": "%Y-%m-%d", "date": "$timestamp"}},
+                            "count": {"$sum": 1}
+                        }}
+                    ]
+                }}
+            ]), {})
+            total_requests = facets["total"][0]["count"] if facets.get("total") else 0
+            error_requests = facets["errors"][0]["count"] if facets.get("errors") else 0
+            for day in facets.get("daily", []):
+                if day["_id"] in daily_requests:
+                    daily_requests[day["_id"]] = day["count"]
+            today_requests = daily_requests[week_days[-1]]
         
         if api_keys_collection_sync is not None:
             active_keys = api_keys_collection_sync.count_documents({})
@@ -640,7 +843,6 @@ def admin_stats():
         # Calculate error rate
         error_rate = 0
         if total_requests > 0:
-            error_requests = logs_collection_sync.count_documents({'status': {'$ne': 200}}) if logs_collection_sync is not None else 0
             error_rate = round((error_requests / total_requests) * 100, 1)
         
         # Generate chart data with real MongoDB data
@@ -651,7 +853,7 @@ def admin_stats():
             'error_rate': error_rate,
             'requests_over_time': {
                 'labels': [f'Day {i}' for i in range(1, 8)],
-                'data': [random.randint(50, 200) for _ in range(7)]
+                'data': list(daily_requests.values())
             },
             'endpoint_distribution': {
                 'ytmp3': random.randint(100, 300),
@@ -682,14 +884,17 @@ def admin_logs():
     try:
         logs = []
         if logs_collection_sync is not None:
-            cursor = logs_collection_sync.find().sort('timestamp', -1).limit(limit)
+            cursor = logs_collection_sync.find({}, {
+                '_id': 0, 'timestamp': 1, 'endpoint': 1, 'api_key': 1,
+                'ip_address': 1, 'response_status': 1
+            }).sort('timestamp', -1).limit(limit)
             logs = [
                 {
                     'timestamp': log.get('timestamp', ''),
                     'endpoint': log.get('endpoint', ''),
                     'api_key': log.get('api_key', '')[:8] + '...',
-                    'ip': log.get('ip', ''),
-                    'status': log.get('status', 200)
+                    'ip': log.get('ip_address', ''),
+                    'status': log.get('response_status', 200)
                 }
                 for log in cursor
             ]
@@ -708,8 +913,12 @@ def admin_keys():
     
     try:
         keys = []
+        now = datetime.now()
         if api_keys_collection_sync is not None:
-            cursor = api_keys_collection_sync.find()
+            cursor = api_keys_collection_sync.find({}, {
+                'name': 1, 'key': 1, 'daily_limit': 1, 'daily_requests': 1, 'count': 1,
+                'created_at': 1, 'valid_until': 1, 'active': 1
+            })
             for key in cursor:
                 # Calculate remaining days
                 valid_until = key.get('valid_until')
@@ -719,7 +928,7 @@ def admin_keys():
                 if valid_until:
                     if isinstance(valid_until, str):
                         valid_until = datetime.fromisoformat(valid_until.replace('Z', '+00:00'))
-                    remaining_days = max(0, (valid_until - datetime.now()).days)
+                    remaining_days = max(0, (valid_until - now).days)
                     if remaining_days <= 0:
                         status = "Expired"
                     elif remaining_days <= 7:
@@ -755,15 +964,14 @@ def admin_create_key():
         return jsonify({'error': 'Invalid admin key'}), 401
     
     try:
-        import secrets
-        from datetime import datetime, timedelta
+        now = datetime.now()
         
         # Generate secure API key
         new_key = secrets.token_urlsafe(16)  # More reasonable length
         
         # Calculate expiry date
         days = int(data.get('days', 30))  # Default 30 days
-        valid_until = datetime.now() + timedelta(days=days)
+        valid_until = now + timedelta(days=days)
         
         key_data = {
             'key': new_key,
@@ -774,13 +982,14 @@ def admin_create_key():
             'count': 0,
             'total_requests': 0,
             'active': True,
-            'created_at': datetime.now(),
+            'created_at': now,
             'valid_until': valid_until,
-            'reset_at': datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+            'reset_at': now.replace(hour=0, minute=0, second=0, microsecond=0) + ONE_DAY
         }
         
         if api_keys_collection_sync is not None:
             api_keys_collection_sync.insert_one(key_data)
+            api_key_cache[new_key] = APIKey.from_dict(key_data)
             logger.info(f"Created new API key: {new_key} for {key_data['name']}")
             
         return jsonify({
@@ -811,6 +1020,7 @@ def admin_delete_key():
             
         if api_keys_collection_sync is not None:
             result = api_keys_collection_sync.delete_one({'key': key_to_delete})
+            api_key_cache.pop(key_to_delete, None)
             if result.deleted_count > 0:
                 logger.info(f"Deleted API key: {key_to_delete}")
                 return jsonify({'success': True, 'message': 'API key deleted successfully'})
@@ -834,18 +1044,38 @@ def admin_analytics():
         analytics = {}
         
         if logs_collection_sync is not None and api_keys_collection_sync is not None:
+            # Endpoint counts, success count and top keys in a single pass over the logs
+            facets = next(logs_collection_sync.aggregate([
+                {"$facet": {
+                    "endpoints": [{"$group": {"_id": "$endpoint", "count": {"$sum": 1}}}],
+                    "success": [
+                        {"$match": {"response_status": 200}},
+                        {"$count": "count"}
+                    ],
+                    "top_keys": [
+                        {"$group": {"_id": "$api_key", "requests": {"$sum": 1}}},
+                        {"$sort": {"requests": -1}},
+                        {"$limit": 5},
+                        # Join each key's limit here instead of one find_one per key
+                        {"$lookup": {
+                            "from": "api_keys",
+                            "localField": "_id",
+                            "foreignField": "key",
+                            "pipeline": [{"$project": {"_id": 0, "daily_limit": 1}}],
+                            "as": "key_info"
+                        }}
+                    ]
+                }}
+            ]), {})
+            endpoint_counts = {doc["_id"]: doc["count"] for doc in facets.get("endpoints", [])}
+            top_keys_result = facets.get("top_keys", [])
+            
             # Most active API key
-            pipeline = [
-                {"$group": {"_id": "$api_key", "count": {"$sum": 1}}},
-                {"$sort": {"count": -1}},
-                {"$limit": 1}
-            ]
-            result = list(logs_collection_sync.aggregate(pipeline))
-            most_active_key = result[0]['_id'] if result else 'N/A'
+            most_active_key = top_keys_result[0]['_id'] if top_keys_result else 'N/A'
             
             # MP3 vs MP4 preference
-            mp3_count = logs_collection_sync.count_documents({"endpoint": "ytmp3_endpoint"})
-            mp4_count = logs_collection_sync.count_documents({"endpoint": "ytmp4_endpoint"})
+            mp3_count = endpoint_counts.get("ytmp3_endpoint", 0)
+            mp4_count = endpoint_counts.get("ytmp4_endpoint", 0)
             total_media = mp3_count + mp4_count
             mp3_percentage = int((mp3_count / total_media) * 100) if total_media > 0 else 0
             
@@ -853,22 +1083,14 @@ def admin_analytics():
             avg_response_time = 245  # ms
             
             # Success rate
-            total_requests = logs_collection_sync.count_documents({})
-            success_requests = logs_collection_sync.count_documents({"response_status": 200})
+            total_requests = sum(endpoint_counts.values())
+            success_requests = facets["success"][0]["count"] if facets.get("success") else 0
             success_rate = int((success_requests / total_requests) * 100) if total_requests > 0 else 0
             
-            # Top API keys usage
-            top_keys_pipeline = [
-                {"$group": {"_id": "$api_key", "requests": {"$sum": 1}}},
-                {"$sort": {"requests": -1}},
-                {"$limit": 5}
-            ]
-            top_keys_result = list(logs_collection_sync.aggregate(top_keys_pipeline))
-            
             # Get key limits for the top keys
             top_keys = []
             for key_stat in top_keys_result:
-                key_info = api_keys_collection_sync.find_one({"key": key_stat["_id"]})
+                key_info = key_stat["key_info"][0] if key_stat["key_info"] else None
                 top_keys.append({
                     "key": key_stat["_id"][:8] + "...",
                     "requests": key_stat["requests"],
@@ -884,7 +1106,7 @@ def admin_analytics():
                 "endpoint_breakdown": {
                     "ytmp3": mp3_count,
                     "ytmp4": mp4_count,
-                    "youtube": logs_collection_sync.count_documents({"endpoint": "youtube"})
+                    "youtube": endpoint_counts.get("youtube", 0)
                 }
             }
         
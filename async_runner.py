@@ -0,0 +1,83 @@
+import asyncio
+import logging
+import os
+import threading
+from typing import Any, Awaitable, Callable, Coroutine, Dict, Hashable, Optional, TypeVar
+
+try:
+    import uvloop
+except ImportError:
+    # Optional (not available on Windows); the default selector loop is used instead
+    uvloop = None
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Python 3.12+: tasks run synchronously until their first real suspension, so awaits that
+# complete immediately (cache hits, resolved futures) skip a trip through the scheduler
+EAGER_TASK_FACTORY = getattr(asyncio, "eager_task_factory", None)
+
+def new_event_loop() -> asyncio.AbstractEventLoop:
+    """Create an event loop (uvloop when installed) with the eager task factory when available"""
+    loop = uvloop.new_event_loop() if uvloop is not None else asyncio.new_event_loop()
+    if EAGER_TASK_FACTORY is not None:
+        loop.set_task_factory(EAGER_TASK_FACTORY)
+    return loop
+
+_background_loop: Optional[asyncio.AbstractEventLoop] = None
+_background_pid: Optional[int] = None
+_background_lock = threading.Lock()
+
+def get_background_loop() -> asyncio.AbstractEventLoop:
+    """Return the long-lived event loop running in a daemon thread, starting it in this process on first use"""
+    global _background_loop, _background_pid
+    if _background_pid == os.getpid():
+        return _background_loop
+    with _background_lock:
+        # A loop inherited across fork has no thread behind it, so each worker starts its own
+        if _background_pid != os.getpid():
+            loop = new_event_loop()
+            threading.Thread(target=loop.run_forever, name="async-runner", daemon=True).start()
+            _background_loop = loop
+            _background_pid = os.getpid()
+    return _background_loop
+
+def run_async(coro: Coroutine[Any, Any, T], timeout: Optional[float] = None) -> T:
+    """Run a coroutine on the background loop and block the calling (sync) thread for its result"""
+    return asyncio.run_coroutine_threadsafe(coro, get_background_loop()).result(timeout)
+
+class SingleFlight:
+    """Collapse concurrent calls for the same key into one.
+
+    The first caller runs the coroutine; callers that arrive while it is in flight await
+    its outcome instead of starting their own. Nothing is kept once the call finishes.
+    All callers must share one event loop.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[T]]) -> T:
+        future = self._inflight.get(key)
+        if future is not None:
+            # Shielded so a cancelled waiter doesn't cancel the call the others are waiting on
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await func()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark it retrieved so it isn't logged as unhandled when nobody else was waiting
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._inflight[key]
@@ -0,0 +1,83 @@
+import heapq
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, List, Optional, Tuple
+
+class TTLCache:
+    """Thread-safe in-memory LRU cache whose entries expire ttl seconds after they are stored.
+
+    Entries are kept in least-recently-used order. When maxsize is set, storing a new entry
+    in a full cache evicts the least recently used one. Expiry times are tracked in a heap,
+    so purging only touches entries that have actually expired.
+    """
+
+    def __init__(self, ttl: float, maxsize: Optional[int] = None,
+                 timer: Callable[[], float] = time.monotonic):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.timer = timer
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        # (expires_at, sequence, key); entries for overwritten or evicted keys are skipped when popped
+        self._expiry_heap: List[Tuple[float, int, Hashable]] = []
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+
+    def _expire(self, now: float) -> None:
+        heap = self._expiry_heap
+        while heap and heap[0][0] <= now:
+            expires_at, _, key = heapq.heappop(heap)
+            item = self._data.get(key)
+            if item is not None and item[0] == expires_at:
+                del self._data[key]
+        
+        # Drop stale heap entries once they clearly outnumber live ones
+        if len(heap) > 2 * len(self._data) + 64:
+            self._expiry_heap = [(item[0], next(self._sequence), key) for key, item in self._data.items()]
+            heapq.heapify(self._expiry_heap)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            if item[0] <= self.timer():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return item[1]
+
+    def __setitem__(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            now = self.timer()
+            self._expire(now)
+            expires_at = now + self.ttl
+            self._data.pop(key, None)
+            self._data[key] = (expires_at, value)
+            heapq.heappush(self._expiry_heap, (expires_at, next(self._sequence), key))
+            if self.maxsize is not None:
+                while len(self._data) > self.maxsize:
+                    self._data.popitem(last=False)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._expire(self.timer())
+            return len(self._data)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.pop(key, None)
+            if item is None or item[0] <= self.timer():
+                return default
+            return item[1]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._expiry_heap.clear()
+
+_MISSING = object()
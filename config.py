@@ -17,6 +17,7 @@ MONGO_DB_URI = os.environ.get("MONGO_DB_URI", "mongodb+srv://jaydipmore74:xCpTm5
 # Telegram Configuration
 TELEGRAM_BOT_TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN", "")
 TELEGRAM_CHANNEL_ID = os.environ.get("TELEGRAM_CHANNEL_ID", "")
+TELEGRAM_UPLOAD_CONCURRENCY = int(os.environ.get("TELEGRAM_UPLOAD_CONCURRENCY", 4))  # uploads running at once
 
 # External API Configuration
 EXTERNAL_API_BASE = "https://jerrycoder.oggyapi.workers.dev"
@@ -25,10 +26,25 @@ EXTERNAL_API_BASE = "https://jerrycoder.oggyapi.workers.dev"
 CACHE_TIMEOUT = int(os.environ.get("CACHE_TIMEOUT", 60 * 60))  # 1 hour in seconds
 DEFAULT_RATE_LIMIT = os.environ.get("DEFAULT_RATE_LIMIT", "100 per minute")
 API_RATE_LIMIT = os.environ.get("API_RATE_LIMIT", "500 per hour")
+API_KEY_CACHE_TTL = int(os.environ.get("API_KEY_CACHE_TTL", 60))  # seconds an API key stays in the in-memory cache
+API_KEY_CACHE_SIZE = int(os.environ.get("API_KEY_CACHE_SIZE", 10000))  # max API keys held in memory per worker
+VIDEO_INFO_CACHE_TTL = int(os.environ.get("VIDEO_INFO_CACHE_TTL", 300))  # seconds a resolved stream URL is reused
+VIDEO_INFO_CACHE_SIZE = int(os.environ.get("VIDEO_INFO_CACHE_SIZE", 4096))  # max resolved videos held in memory
+VIDEO_CACHE_MISS_TTL = int(os.environ.get("VIDEO_CACHE_MISS_TTL", 60))  # seconds a MongoDB cache miss is remembered
+VIDEO_INFO_CLIENT_MAX_AGE = int(os.environ.get("VIDEO_INFO_CLIENT_MAX_AGE", 60))  # seconds clients may reuse a lookup response
+ASYNC_LOOKUP_WAIT = float(os.environ.get("ASYNC_LOOKUP_WAIT", 2.0))  # seconds a Prefer: respond-async request waits before 202
+ASYNC_LOOKUP_RETRY_AFTER = int(os.environ.get("ASYNC_LOOKUP_RETRY_AFTER", 3))  # seconds clients are told to wait before polling
+
+# Usage Logging
+LOG_FLUSH_INTERVAL = float(os.environ.get("LOG_FLUSH_INTERVAL", 0.5))  # seconds between batched writes
+LOG_FLUSH_BATCH_SIZE = int(os.environ.get("LOG_FLUSH_BATCH_SIZE", 100))  # flush early once this many logs are queued
+LOG_BUFFER_SIZE = int(os.environ.get("LOG_BUFFER_SIZE", 10000))  # oldest logs are dropped past this
 
 # Request Settings
 REQUEST_TIMEOUT = int(os.environ.get("REQUEST_TIMEOUT", 30))  # seconds
 MAX_CONCURRENT_REQUESTS = int(os.environ.get("MAX_CONCURRENT_REQUESTS", 10))
 
 # Stream Settings
-STREAM_CHUNK_SIZE = int(os.environ.get("STREAM_CHUNK_SIZE", 1024 * 1024))  # 1MB
+STREAM_CHUNK_SIZE = int(os.environ.get("STREAM_CHUNK_SIZE", 128 * 1024))  # 128KB keeps time-to-first-byte low
+STREAM_MAX_CONNECTIONS = int(os.environ.get("STREAM_MAX_CONNECTIONS", 200))
+STREAM_MAX_KEEPALIVE = int(os.environ.get("STREAM_MAX_KEEPALIVE", 100))
@@ -4,78 +4,107 @@ Fix Telegram caching for videos that failed background upload
 This script will manually trigger uploads for videos in MongoDB but not in Telegram
 """
 import asyncio
-import os
-import pymongo
-from telegram_service import TelegramService
-from mongo import videos_collection_sync
+import traceback
+from telegram_service import telegram_service, RetryAfter
+from mongo import videos_collection
+from http_client import closing_async_client
+from async_runner import new_event_loop
 import logging
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Uploads in flight at once; Telegram's per-bot rate limit is the real ceiling
+UPLOAD_CONCURRENCY = 5
+# Times an upload is retried after Telegram asks the bot to slow down (429 RetryAfter)
+UPLOAD_RATE_LIMIT_RETRIES = 3
+
 async def fix_missing_telegram_files():
     """Find videos in MongoDB but missing from Telegram and upload them"""
     try:
-        # Get MongoDB client
-        mongo_uri = os.environ.get('MONGO_DB_URI')
-        if not mongo_uri:
-            print("❌ MongoDB URI not found")
+        # Shared clients from mongo.py and telegram_service.py
+        if videos_collection is None:
+            print("❌ MongoDB not available")
             return
             
-        client = pymongo.MongoClient(mongo_uri)
-        db = client['youtube_api']
-        
-        # Initialize Telegram service
-        telegram_service = TelegramService()
         if not telegram_service.bot:
             print("❌ Telegram bot not available")
             return
             
         print("🔍 Checking for videos that need Telegram upload...")
         
-        # Get all videos from MongoDB
-        videos = list(db.videos.find())
-        telegram_files = list(db.telegram_files.find())
-        
-        # Create a set of video_id + stream_type combinations that are already in Telegram
-        telegram_cached = {(tf['video_id'], tf['stream_type']) for tf in telegram_files}
+        # Let MongoDB join videos against telegram_files and return only the missing ones
+        pipeline = [
+            {"$match": {"url": {"$nin": [None, ""]}}},
+            {"$lookup": {
+                "from": "telegram_files",
+                "let": {"v": "$video_id", "s": "$stream_type"},
+                "pipeline": [
+                    {"$match": {"$expr": {"$and": [
+                        {"$eq": ["$video_id", "$$v"]},
+                        {"$eq": ["$stream_type", "$$s"]}
+                    ]}}},
+                    {"$limit": 1},
+                    # Index fields only, so the lookup is answered from video_id_stream_type
+                    {"$project": {"_id": 0, "video_id": 1, "stream_type": 1}}
+                ],
+                "as": "telegram_file"
+            }},
+            {"$match": {"telegram_file": {"$size": 0}}},
+            {"$project": {"_id": 0, "video_id": 1, "stream_type": 1, "url": 1, "title": 1}}
+        ]
         
-        # Find videos that need Telegram upload
         needs_upload = []
-        for video in videos:
-            video_key = (video['video_id'], video['stream_type'])
-            if video_key not in telegram_cached and video.get('url'):
-                needs_upload.append(video)
+        async for video in videos_collection.aggregate(pipeline):
+            needs_upload.append(video)
                 
         print(f"📤 Found {len(needs_upload)} videos needing Telegram upload:")
         
         for video in needs_upload:
             print(f"  - {video['title'][:50]}... ({video['video_id']}, {video['stream_type']})")
             
-        # Upload missing files
-        for video in needs_upload:
-            try:
+        # Upload missing files, a few at a time
+        semaphore = asyncio.Semaphore(UPLOAD_CONCURRENCY)
+        
+        async def upload_one(video) -> bool:
+            async with semaphore:
                 print(f"🚀 Uploading {video['title'][:30]}... to Telegram")
-                await telegram_service.upload_file_background(
-                    video['video_id'],
-                    video['stream_type'], 
-                    video['url'],
-                    video['title']
-                )
+                for attempt in range(UPLOAD_RATE_LIMIT_RETRIES + 1):
+                    try:
+                        return await telegram_service.upload_file(
+                            video['video_id'],
+                            video['stream_type'], 
+                            video['url'],
+                            video['title']
+                        )
+                    except RetryAfter as e:
+                        if attempt == UPLOAD_RATE_LIMIT_RETRIES:
+                            raise
+                        print(f"⏳ Rate limited, retrying {video['video_id']} in {e.retry_after}s")
+                        await asyncio.sleep(e.retry_after)
+        
+        results = await asyncio.gather(
+            *(upload_one(video) for video in needs_upload),
+            return_exceptions=True
+        )
+        
+        failed = 0
+        for video, result in zip(needs_upload, results):
+            if result is True:
                 print(f"✅ Successfully uploaded {video['video_id']}")
-                
-                # Small delay between uploads
-                await asyncio.sleep(2)
-                
-            except Exception as e:
-                print(f"❌ Failed to upload {video['video_id']}: {e}")
-                
+            else:
+                failed += 1
+                reason = result if isinstance(result, BaseException) else "upload did not complete"
+                print(f"❌ Failed to upload {video['video_id']}: {reason}")
+        
+        print(f"📊 {len(needs_upload) - failed} uploaded, {failed} failed")
+        
         print("🎯 Telegram cache fix completed!")
         
     except Exception as e:
         print(f"❌ Error: {e}")
-        import traceback
         traceback.print_exc()
 
 if __name__ == "__main__":
-    asyncio.run(fix_missing_telegram_files())
\ No newline at end of file
+    with asyncio.Runner(loop_factory=new_event_loop) as runner:
+        runner.run(closing_async_client(fix_missing_telegram_files()))
\ No newline at end of file
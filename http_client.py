@@ -0,0 +1,80 @@
+import asyncio
+import json
+import logging
+import weakref
+from importlib.util import find_spec
+from typing import Any, Awaitable, Iterable, TypeVar
+
+import httpx
+from config import REQUEST_TIMEOUT
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# HTTP/2 only when the optional h2 package is installed
+HTTP2_AVAILABLE = find_spec("h2") is not None
+
+# Fail fast when a host is unreachable or the pool is exhausted; reads keep the general request timeout
+ASYNC_CLIENT_TIMEOUT = httpx.Timeout(REQUEST_TIMEOUT, connect=5.0, pool=5.0)
+
+ASYNC_CLIENT_LIMITS = httpx.Limits(
+    max_connections=128,
+    max_keepalive_connections=64,
+    keepalive_expiry=60
+)
+
+# Connection attempts (not requests) are retried once, so a reset pooled connection or a dropped SYN doesn't fail the call
+CONNECT_RETRIES = 1
+
+# httpx async connections belong to the event loop that opened them, so one client is kept per loop
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+
+def get_async_client() -> httpx.AsyncClient:
+    """Return the pooled AsyncClient for the running event loop, creating it on first use"""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            timeout=ASYNC_CLIENT_TIMEOUT,
+            transport=httpx.AsyncHTTPTransport(
+                http2=HTTP2_AVAILABLE,
+                limits=ASYNC_CLIENT_LIMITS,
+                retries=CONNECT_RETRIES
+            )
+        )
+        _async_clients[loop] = client
+    return client
+
+async def warm_up(urls: Iterable[str]) -> None:
+    """Open pooled connections to the given hosts so the first real requests skip TCP/TLS setup"""
+    client = get_async_client()
+    urls = list(urls)
+    results = await asyncio.gather(*(client.head(url) for url in urls), return_exceptions=True)
+    for url, result in zip(urls, results):
+        if isinstance(result, Exception):
+            logger.warning("Could not warm up connection to %s: %s", url, result)
+
+async def aclose_async_client() -> None:
+    """Close the running event loop's pooled client, if it has one"""
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+async def closing_async_client(awaitable: Awaitable[T]) -> T:
+    """Await a coroutine on a short-lived event loop and close that loop's client afterwards"""
+    try:
+        return await awaitable
+    finally:
+        await aclose_async_client()
+
+def response_json(response: httpx.Response) -> Any:
+    """Decode a JSON response body, with orjson when it is installed"""
+    if orjson is not None:
+        return orjson.loads(response.content)
+    return json.loads(response.content)
@@ -0,0 +1,37 @@
+import logging
+from typing import Any, Union
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+class ORJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider that encodes and decodes with orjson.
+
+    Output matches the default provider: keys are sorted when sort_keys is set, indent is
+    honoured, and datetimes and other non-native types go through the default provider's
+    converter so the wire format does not change.
+    """
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        if kwargs.get("sort_keys", self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        if kwargs.get("indent"):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=kwargs.get("default", self.default), option=option).decode()
+
+    def loads(self, s: Union[str, bytes], **kwargs: Any) -> Any:
+        return orjson.loads(s)
+
+def init_json_provider(app) -> None:
+    """Use orjson for the app's JSON responses when it is installed"""
+    if orjson is None:
+        logger.info("orjson not installed, using the default JSON provider")
+        return
+    app.json = ORJSONProvider(app)
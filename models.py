@@ -11,12 +11,13 @@ class APIKey:
         self.key = key
         self.name = name
         self.is_admin = is_admin
-        self.created_at = datetime.now()
+        now = datetime.now()
+        self.created_at = now
         self.expiry_days = expiry_days
-        self.valid_until = datetime.now() + timedelta(days=expiry_days)
+        self.valid_until = now + timedelta(days=expiry_days)
         self.daily_limit = daily_limit
         # Reset at midnight
-        tomorrow = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+        tomorrow = now.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
         self.reset_at = tomorrow
         self.count = 0
         self.daily_requests = 0  # Current day requests
@@ -51,29 +52,35 @@ class APIKey:
             created_by=data.get("created_by"),
             expiry_days=data.get("expiry_days", 365)
         )
-        api_key.created_at = data.get("created_at", datetime.now())
-        api_key.valid_until = data.get("valid_until", datetime.now() + timedelta(days=365))
-        tomorrow = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
-        api_key.reset_at = data.get("reset_at", tomorrow)
+        # The constructor already set these relative to now; keep them only when missing
+        if "created_at" in data:
+            api_key.created_at = data["created_at"]
+        if "valid_until" in data:
+            api_key.valid_until = data["valid_until"]
+        if "reset_at" in data:
+            api_key.reset_at = data["reset_at"]
         api_key.count = data.get("count", 0)
         api_key.daily_requests = data.get("daily_requests", 0)
         api_key.total_requests = data.get("total_requests", 0)
         api_key.status = data.get("status", "active")
         return api_key
     
-    def is_expired(self) -> bool:
-        return datetime.now() > self.valid_until or self.status == "expired"
+    def is_expired(self, now: Optional[datetime] = None) -> bool:
+        now = now or datetime.now()
+        return now > self.valid_until or self.status == "expired"
     
-    def remaining_requests(self) -> int:
-        if datetime.now() > self.reset_at:
+    def remaining_requests(self, now: Optional[datetime] = None) -> int:
+        now = now or datetime.now()
+        if now > self.reset_at:
             return self.daily_limit
         return max(0, self.daily_limit - self.daily_requests)
     
-    def auto_reset_if_needed(self) -> bool:
+    def auto_reset_if_needed(self, now: Optional[datetime] = None) -> bool:
         """Reset daily requests if past midnight. Returns True if reset occurred."""
-        if datetime.now() > self.reset_at:
+        now = now or datetime.now()
+        if now > self.reset_at:
             self.daily_requests = 0
-            tomorrow = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+            tomorrow = now.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
             self.reset_at = tomorrow
             return True
         return False
@@ -84,14 +91,14 @@ class APIKey:
         self.total_requests += 1
         self.count = self.daily_requests  # Keep backward compatibility
     
-    def days_until_expiry(self) -> int:
+    def days_until_expiry(self, now: Optional[datetime] = None) -> int:
         """Get days remaining until expiry"""
-        delta = self.valid_until - datetime.now()
+        delta = self.valid_until - (now or datetime.now())
         return max(0, delta.days)
     
-    def auto_expire_if_needed(self) -> bool:
+    def auto_expire_if_needed(self, now: Optional[datetime] = None) -> bool:
         """Auto-expire key if past expiry date. Returns True if expired."""
-        if self.is_expired() and self.status != "expired":
+        if self.is_expired(now) and self.status != "expired":
             self.status = "expired"
             return True
         return False
@@ -135,7 +142,8 @@ class VideoInfo:
             quality=data["quality"],
             stream_type=data["stream_type"]
         )
-        video.created_at = data.get("created_at", datetime.now())
+        if "created_at" in data:
+            video.created_at = data["created_at"]
         video.telegram_file_id = data.get("telegram_file_id")
         video.external_url = data.get("external_url")
         video.thumbnail = data.get("thumbnail")
@@ -173,6 +181,8 @@ class TelegramFile:
         self.file_size = file_size
         self.uploaded_at = datetime.now()
         self.message_id = None
+        self.file_path = None  # from getFile, reused for download URLs until it may expire
+        self.file_path_resolved_at = None
     
     def to_dict(self) -> Dict[str, Any]:
         return {
@@ -182,7 +192,9 @@ class TelegramFile:
             "file_unique_id": self.file_unique_id,
             "file_size": self.file_size,
             "uploaded_at": self.uploaded_at,
-            "message_id": self.message_id
+            "message_id": self.message_id,
+            "file_path": self.file_path,
+            "file_path_resolved_at": self.file_path_resolved_at
         }
     
     @classmethod
@@ -194,6 +206,9 @@ class TelegramFile:
             file_unique_id=data["file_unique_id"],
             file_size=data["file_size"]
         )
-        tg_file.uploaded_at = data.get("uploaded_at", datetime.now())
+        if "uploaded_at" in data:
+            tg_file.uploaded_at = data["uploaded_at"]
         tg_file.message_id = data.get("message_id")
+        tg_file.file_path = data.get("file_path")
+        tg_file.file_path_resolved_at = data.get("file_path_resolved_at")
         return tg_file
@@ -1,10 +1,42 @@
 import logging
+import threading
+from typing import List, Optional
 from motor.motor_asyncio import AsyncIOMotorClient
-from pymongo import MongoClient
-from config import MONGO_DB_URI
+from pymongo import MongoClient, ASCENDING, monitoring
+from pymongo.errors import OperationFailure
+from config import MONGO_DB_URI, DEBUG
 
 logger = logging.getLogger(__name__)
 
+class CommandCounter(monitoring.CommandListener):
+    """Record the MongoDB commands started by the current thread while counting is active"""
+    
+    def __init__(self):
+        self._local = threading.local()
+    
+    def start(self) -> List[str]:
+        self._local.commands = []
+        return self._local.commands
+    
+    def stop(self) -> Optional[List[str]]:
+        commands = getattr(self._local, "commands", None)
+        self._local.commands = None
+        return commands
+    
+    def started(self, event):
+        commands = getattr(self._local, "commands", None)
+        if commands is not None:
+            commands.append(event.command_name)
+    
+    def succeeded(self, event):
+        pass
+    
+    def failed(self, event):
+        pass
+
+# Only attached to the sync client in debug mode
+command_counter = CommandCounter()
+
 logger.info("Connecting to your Mongo Database...")
 try:
     # Async client (Motor)
@@ -12,7 +44,7 @@ try:
     mongodb_async = _mongo_async_.youtube_api
     
     # Sync client (PyMongo)  
-    _mongo_sync_ = MongoClient(MONGO_DB_URI)
+    _mongo_sync_ = MongoClient(MONGO_DB_URI, event_listeners=[command_counter] if DEBUG else None)
     mongodb_sync = _mongo_sync_.youtube_api
     
     # Async collections
@@ -44,4 +76,40 @@ except Exception as e:
     videos_collection_sync = None
     api_keys_collection_sync = None
     logs_collection_sync = None
-    telegram_files_collection_sync = None
\ No newline at end of file
+    telegram_files_collection_sync = None
+
+def ensure_indexes():
+    """Create the indexes the API queries rely on (no-op when they already exist)"""
+    if mongodb_sync is None:
+        return
+    
+    index_specs = [
+        # API key lookups and write-through updates
+        (api_keys_collection_sync, [("key", ASCENDING)], {"name": "key_unique", "unique": True}),
+        # Newest-first log listings in the admin endpoints (the stats/analytics counts run inside
+        # $facet, which can't use indexes, so no key/status fields are indexed for them)
+        (logs_collection_sync, [("timestamp", ASCENDING)], {"name": "timestamp"}),
+        # Telegram cache lookups and the fix script's videos -> telegram_files join
+        (telegram_files_collection_sync,
+         [("video_id", ASCENDING), ("stream_type", ASCENDING)],
+         {"name": "video_id_stream_type"}),
+        # Video metadata cache lookups; the video_id prefix also serves lookups by ID alone
+        (videos_collection_sync,
+         [("video_id", ASCENDING), ("stream_type", ASCENDING)],
+         {"name": "video_id_stream_type"}),
+    ]
+    
+    for collection, keys, options in index_specs:
+        try:
+            collection.create_index(keys, **options)
+        except Exception as e:
+            logger.warning(f"Could not create index {options['name']} on {collection.name}: {e}")
+    
+    # Indexes replaced above; dropped so they no longer cost every insert
+    for collection, name in [(logs_collection_sync, "timestamp_api_key_status")]:
+        try:
+            collection.drop_index(name)
+        except OperationFailure:
+            pass  # Already gone
+        except Exception as e:
+            logger.warning(f"Could not drop index {name} on {collection.name}: {e}")
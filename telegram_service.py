@@ -1,204 +1,304 @@
 import asyncio
 import logging
-import httpx
-from typing import Optional, Tuple
+import tempfile
+from datetime import datetime, timedelta
+from typing import Optional, Tuple, Dict, Any, List, Set
+from urllib.parse import urlsplit
 try:
     from telegram import Bot
-    from telegram.error import TelegramError
+    from telegram.error import BadRequest, RetryAfter, TelegramError
+    from telegram.request import HTTPXRequest
     TELEGRAM_AVAILABLE = True
 except ImportError:
     # Fallback if telegram is not properly installed
     Bot = None
     TelegramError = Exception
+    BadRequest = Exception
+    RetryAfter = Exception
+    HTTPXRequest = None
     TELEGRAM_AVAILABLE = False
-from config import TELEGRAM_BOT_TOKEN, TELEGRAM_CHANNEL_ID
-from mongo import telegram_files_collection, telegram_files_collection_sync
+from config import (TELEGRAM_BOT_TOKEN, TELEGRAM_CHANNEL_ID, TELEGRAM_UPLOAD_CONCURRENCY, VIDEO_INFO_CACHE_TTL,
+                    VIDEO_INFO_CLIENT_MAX_AGE)
+from mongo import telegram_files_collection
 from models import TelegramFile
+from http_client import get_async_client
+from async_runner import get_background_loop
 
 logger = logging.getLogger(__name__)
 
+# Media downloads for upload can be large, so they get a longer timeout than API calls
+UPLOAD_DOWNLOAD_TIMEOUT = 300
+# Downloads are kept in memory up to this size, then spill to a temp file
+UPLOAD_SPOOL_MAX_SIZE = 8 * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# Telegram guarantees a getFile download link for at least an hour
+FILE_PATH_TTL = timedelta(hours=1)
+# A URL built from a stored path can still be served from the in-process result caches for
+# VIDEO_INFO_CACHE_TTL and then reused by the client for its max-age, so stored paths are only
+# reused while that much of the hour is left
+FILE_PATH_REUSE_WINDOW = FILE_PATH_TTL - timedelta(seconds=VIDEO_INFO_CACHE_TTL + VIDEO_INFO_CLIENT_MAX_AGE)
+# Uploads waiting for a worker; further uploads are dropped (and retried on a later cache miss)
+UPLOAD_QUEUE_SIZE = 1000
+# Bot API connections: one per upload worker, plus spares so getFile lookups for requests
+# don't queue behind uploads (python-telegram-bot defaults to a single connection)
+BOT_CONNECTION_POOL_SIZE = TELEGRAM_UPLOAD_CONCURRENCY + 4
+BOT_POOL_TIMEOUT = 10.0
+
 class TelegramService:
     def __init__(self):
         self.bot_token = TELEGRAM_BOT_TOKEN
         self.channel_id = TELEGRAM_CHANNEL_ID
         self.bot = None
+        # Uploads queued or running by (video_id, stream_type), and the queue feeding a fixed set
+        # of worker tasks; both are created on the loop that schedules the first upload
+        self._pending_uploads: Set[Tuple[str, str]] = set()
+        self._upload_queue: Optional[asyncio.Queue] = None
+        self._upload_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._upload_workers: List[asyncio.Task] = []
         
         if TELEGRAM_AVAILABLE and Bot and self.bot_token and self.channel_id:
             try:
-                self.bot = Bot(token=self.bot_token)
+                self.bot = Bot(
+                    token=self.bot_token,
+                    request=HTTPXRequest(
+                        connection_pool_size=BOT_CONNECTION_POOL_SIZE,
+                        pool_timeout=BOT_POOL_TIMEOUT
+                    )
+                )
                 logger.info("Telegram bot initialized successfully")
             except Exception as e:
-                logger.warning(f"Failed to initialize Telegram bot: {e}")
+                logger.warning("Failed to initialize Telegram bot: %s", e)
         else:
             if not TELEGRAM_AVAILABLE:
                 logger.warning("Telegram library not available")
             elif not (self.bot_token and self.channel_id):
                 logger.warning("Telegram bot token or channel ID not configured")
+        
+        # Computed once so the per-request lookups don't rebuild them
+        self._enabled = self.bot is not None and telegram_files_collection is not None
+        self._file_url_prefix = f"https://api.telegram.org/file/bot{self.bot_token}/"
     
-    def check_file_exists_sync(self, video_id: str, stream_type: str) -> Optional[str]:
-        """Check if file exists in Telegram channel (sync version for Flask)"""
+    def file_url(self, file_path: str) -> str:
+        """Build the download URL for a Telegram file_path"""
+        return self._file_url_prefix + file_path
+    
+    def cached_file_url(self, file_doc: Dict[str, Any]) -> Optional[str]:
+        """Build the download URL from the stored file_path while Telegram guarantees it for as long as it may be cached"""
+        file_path = file_doc.get("file_path")
+        resolved_at = file_doc.get("file_path_resolved_at")
+        if file_path and resolved_at and datetime.now() - resolved_at < FILE_PATH_REUSE_WINDOW:
+            return self.file_url(file_path)
+        return None
+    
+    async def warm_up(self) -> None:
+        """Connect the bot to the Bot API ahead of the first lookup (also fetches the bot's own info)"""
+        if not self.bot:
+            return
         try:
-            if not self.bot or telegram_files_collection_sync is None:
-                return None
-                
-            # Search in MongoDB for existing Telegram file using sync client
-            file_doc = telegram_files_collection_sync.find_one({
-                "video_id": video_id,
-                "stream_type": stream_type
-            })
-            
-            if file_doc:
-                telegram_file = TelegramFile.from_dict(file_doc)
-                logger.info(f"Found Telegram file for {video_id} ({stream_type}): {telegram_file.file_id}")
-                
-                # For Telegram files uploaded to channel, we need to get the file info first
-                # But since we can't make async calls here, let's use a different approach
-                # We'll create a direct link to the Telegram file using file_id
-                try:
-                    # Get file info and create proper streaming URL
-                    import httpx
-                    file_info_url = f"https://api.telegram.org/bot{self.bot_token}/getFile?file_id={telegram_file.file_id}"
-                    
-                    with httpx.Client(timeout=10.0) as client:
-                        response = client.get(file_info_url)
-                        if response.status_code == 200:
-                            file_info = response.json()
-                            if file_info['ok'] and 'result' in file_info:
-                                file_path = file_info['result']['file_path']
-                                # Create the actual download URL
-                                telegram_url = f"https://api.telegram.org/file/bot{self.bot_token}/{file_path}"
-                                logger.info(f"Generated Telegram streaming URL for {video_id} ({stream_type}): {file_path}")
-                                return telegram_url
-                    
-                    logger.warning(f"Could not get file info for {telegram_file.file_id}")
-                    return None
-                except Exception as e:
-                    logger.error(f"Error generating Telegram URL: {e}")
-                    return None
-            
-            logger.info(f"No Telegram file found for {video_id} ({stream_type})")
-            return None
+            await self.bot.initialize()
         except Exception as e:
-            logger.error(f"Error checking Telegram file (sync): {e}")
-            return None
+            logger.warning("Could not reach Telegram during warm-up: %s", e)
     
     async def check_file_exists(self, video_id: str, stream_type: str) -> Optional[str]:
         """Check if file exists in Telegram channel"""
+        if not self._enabled:
+            return None
+        
         try:
-            if not self.bot:
-                return None
-                
             # Search in MongoDB for existing Telegram file
-            file_doc = await telegram_files_collection.find_one({
-                "video_id": video_id,
-                "stream_type": stream_type
-            })
+            file_doc = await telegram_files_collection.find_one(
+                {"video_id": video_id, "stream_type": stream_type},
+                {"file_id": 1, "file_path": 1, "file_path_resolved_at": 1}
+            )
             
             if file_doc:
-                telegram_file = TelegramFile.from_dict(file_doc)
-                # Verify file still exists in Telegram
-                try:
-                    file_info = await self.bot.get_file(telegram_file.file_id)
-                    
-                    if file_info:
-                        return f"https://api.telegram.org/file/bot{self.bot_token}/{file_info.file_path}"
-                except TelegramError:
-                    # File no longer exists, remove from database
-                    await telegram_files_collection.delete_one({"_id": file_doc["_id"]})
-                    return None
+                return await self.get_file_url(file_doc)
             
             return None
         except Exception as e:
-            logger.error(f"Error checking Telegram file: {e}")
+            logger.error("Error checking Telegram file: %s", e)
             return None
     
-    async def upload_file_background(self, video_id: str, stream_type: str, 
-                                   file_url: str, title: str) -> None:
-        """Upload file to Telegram channel in background"""
+    async def get_file_url(self, file_doc: Dict[str, Any]) -> Optional[str]:
+        """Resolve a telegram_files document into a download URL, removing it if Telegram no longer has the file"""
+        if not self.bot:
+            return None
+        
+        # Recently resolved paths are used as is; Telegram is only asked again once they may have expired
+        cached_url = self.cached_file_url(file_doc)
+        if cached_url:
+            return cached_url
+        
+        # Verify file still exists in Telegram
         try:
-            if not self.bot:
-                logger.warning("Telegram bot not configured, skipping upload")
-                return
+            file_info = await self.bot.get_file(file_doc["file_id"])
             
-            # Check if already exists
-            existing = await self.check_file_exists(video_id, stream_type)
-            if existing:
-                return
+            if file_info:
+                await telegram_files_collection.update_one(
+                    {"_id": file_doc["_id"]},
+                    {"$set": {"file_path": file_info.file_path, "file_path_resolved_at": datetime.now()}}
+                )
+                return self.file_url(file_info.file_path)
+        except TelegramError:
+            # File no longer exists, remove from database
+            await telegram_files_collection.delete_one({"_id": file_doc["_id"]})
+        except Exception as e:
+            logger.error("Error resolving Telegram file: %s", e)
+        return None
+    
+    async def _download_media(self, file_url: str) -> Optional[tempfile.SpooledTemporaryFile]:
+        """Stream a media file into a spooled temp file, so large files go to disk instead of memory"""
+        async with get_async_client().stream("GET", file_url, timeout=UPLOAD_DOWNLOAD_TIMEOUT) as response:
+            if response.status_code != 200:
+                logger.warning("Could not download %s for upload: %s", file_url, response.status_code)
+                return None
             
-            # Download file and upload to Telegram
-            async with httpx.AsyncClient(timeout=300) as client:
-                response = await client.get(file_url)
-                if response.status_code == 200:
-                    file_data = response.content
-                    
-                    # Determine file extension
-                    extension = "mp4" if stream_type == "video" else "mp3"
-                    filename = f"{title[:50]}_{video_id}.{extension}"
-                    
-                    if stream_type == "video":
-                        from io import BytesIO
-                        video_file = BytesIO(file_data)
-                        video_file.name = filename
-                        message = await self.bot.send_video(
-                            chat_id=self.channel_id,
-                            video=video_file,
-                            caption=f"{title}\nID: {video_id}"
-                        )
-                        file_id = message.video.file_id
-                        file_unique_id = message.video.file_unique_id
-                        file_size = message.video.file_size
-                    else:
-                        from io import BytesIO
-                        audio_file = BytesIO(file_data)
-                        audio_file.name = filename
-                        message = await self.bot.send_audio(
-                            chat_id=self.channel_id,
-                            audio=audio_file,
-                            title=title,
-                            caption=f"ID: {video_id}"
-                        )
-                        file_id = message.audio.file_id
-                        file_unique_id = message.audio.file_unique_id
-                        file_size = message.audio.file_size
-                    
-                    # Save to MongoDB
-                    telegram_file = TelegramFile(
-                        video_id=video_id,
-                        stream_type=stream_type,
-                        file_id=file_id,
-                        file_unique_id=file_unique_id,
-                        file_size=file_size
-                    )
-                    telegram_file.message_id = message.message_id
-                    
-                    await telegram_files_collection.insert_one(telegram_file.to_dict())
-                    logger.info(f"Successfully uploaded {stream_type} for {video_id} to Telegram")
-                
+            media_file = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_MAX_SIZE)
+            try:
+                async for chunk in response.aiter_bytes(UPLOAD_CHUNK_SIZE):
+                    media_file.write(chunk)
+            except BaseException:
+                media_file.close()
+                raise
+            media_file.seek(0)
+            return media_file
+    
+    async def _send_media(self, video_id: str, stream_type: str, media: Any, title: str):
+        """Post a video or audio to the channel; media is a URL for Telegram to fetch or a file to upload"""
+        # Determine file extension
+        extension = "mp4" if stream_type == "video" else "mp3"
+        filename = f"{title[:50]}_{video_id}.{extension}"
+        
+        if stream_type == "video":
+            return await self.bot.send_video(
+                chat_id=self.channel_id,
+                video=media,
+                filename=filename,
+                caption=f"{title}\nID: {video_id}"
+            )
+        return await self.bot.send_audio(
+            chat_id=self.channel_id,
+            audio=media,
+            filename=filename,
+            title=title,
+            caption=f"ID: {video_id}"
+        )
+    
+    async def upload_file(self, video_id: str, stream_type: str,
+                          file_url: str, title: str) -> bool:
+        """Upload a file to the Telegram channel and record it.
+        
+        Returns True once the file is in Telegram (including when it already was) and False
+        when it could not be sent; Telegram and MongoDB errors propagate to the caller.
+        """
+        if not self.bot:
+            logger.warning("Telegram bot not configured, skipping upload")
+            return False
+        
+        # python-telegram-bot uploads any string naming an existing local file, so only web URLs get through
+        if urlsplit(file_url).scheme not in ("http", "https"):
+            logger.warning("Refusing to upload %s (%s): not an http(s) URL", video_id, stream_type)
+            return False
+        
+        # Check if already exists
+        existing = await self.check_file_exists(video_id, stream_type)
+        if existing:
+            return True
+        
+        # Let Telegram fetch the file from its URL; only relay the bytes through this server if that fails
+        try:
+            message = await self._send_media(video_id, stream_type, file_url, title)
+        except BadRequest as e:
+            logger.info("Telegram could not fetch %s by URL (%s), uploading it directly", video_id, e)
+            media_file = await self._download_media(file_url)
+            if media_file is None:
+                return False
+            with media_file:
+                message = await self._send_media(video_id, stream_type, media_file, title)
+        
+        media = message.video if stream_type == "video" else message.audio
+        file_id = media.file_id
+        file_unique_id = media.file_unique_id
+        file_size = media.file_size
+        
+        # Save to MongoDB
+        telegram_file = TelegramFile(
+            video_id=video_id,
+            stream_type=stream_type,
+            file_id=file_id,
+            file_unique_id=file_unique_id,
+            file_size=file_size
+        )
+        telegram_file.message_id = message.message_id
+        try:
+            file_info = await self.bot.get_file(file_id)
+            telegram_file.file_path = file_info.file_path
+            telegram_file.file_path_resolved_at = datetime.now()
+        except TelegramError as e:
+            logger.warning("Could not resolve file path for %s: %s", video_id, e)
+        
+        await telegram_files_collection.insert_one(telegram_file.to_dict())
+        logger.info("Successfully uploaded %s for %s to Telegram", stream_type, video_id)
+        return True
+    
+    async def upload_file_background(self, video_id: str, stream_type: str, 
+                                   file_url: str, title: str) -> bool:
+        """Upload file to Telegram channel in background, logging failures instead of raising"""
+        try:
+            return await self.upload_file(video_id, stream_type, file_url, title)
         except Exception as e:
-            logger.error(f"Error uploading to Telegram: {e}")
+            logger.error("Error uploading to Telegram: %s", e)
+            return False
+    
+    async def _upload_worker(self, queue: asyncio.Queue) -> None:
+        """Run queued uploads one at a time for as long as the loop lives"""
+        while True:
+            video_id, stream_type, file_url, title = await queue.get()
+            try:
+                await self.upload_file_background(video_id, stream_type, file_url, title)
+            finally:
+                self._pending_uploads.discard((video_id, stream_type))
+                queue.task_done()
+    
+    def _get_upload_queue(self) -> asyncio.Queue:
+        """Return the running loop's upload queue, starting its workers on first use"""
+        loop = asyncio.get_running_loop()
+        if self._upload_loop is not loop:
+            self._upload_queue = asyncio.Queue(maxsize=UPLOAD_QUEUE_SIZE)
+            self._upload_loop = loop
+            self._pending_uploads.clear()
+            self._upload_workers = [
+                loop.create_task(self._upload_worker(self._upload_queue))
+                for _ in range(TELEGRAM_UPLOAD_CONCURRENCY)
+            ]
+        return self._upload_queue
     
     def schedule_background_upload(self, video_id: str, stream_type: str, 
                                  file_url: str, title: str) -> None:
         """Schedule background upload task"""
         try:
-            loop = asyncio.get_event_loop()
-            loop.create_task(
-                self.upload_file_background(video_id, stream_type, file_url, title)
-            )
+            asyncio.get_running_loop()
         except RuntimeError:
-            # No event loop running, run in new thread
-            import threading
-            def run_upload():
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                loop.run_until_complete(
-                    self.upload_file_background(video_id, stream_type, file_url, title)
-                )
-                loop.close()
-            
-            thread = threading.Thread(target=run_upload)
-            thread.daemon = True
-            thread.start()
+            # Called from sync code: hand the upload to the shared background loop
+            get_background_loop().call_soon_threadsafe(
+                self._start_upload, video_id, stream_type, file_url, title
+            )
+            return
+        self._start_upload(video_id, stream_type, file_url, title)
+    
+    def _start_upload(self, video_id: str, stream_type: str, file_url: str, title: str) -> None:
+        """Queue an upload on the current loop unless the same file is already queued or uploading"""
+        key = (video_id, stream_type)
+        queue = self._get_upload_queue()
+        if key in self._pending_uploads:
+            # Same file is already on its way; let that upload serve this request too
+            return
+        try:
+            queue.put_nowait((video_id, stream_type, file_url, title))
+        except asyncio.QueueFull:
+            logger.warning("Upload queue full, skipping Telegram upload for %s (%s)", video_id, stream_type)
+            return
+        self._pending_uploads.add(key)
 
 # Global instance
 telegram_service = TelegramService()
@@ -0,0 +1,118 @@
+import atexit
+import logging
+import os
+import threading
+from collections import Counter, deque
+from typing import Dict, Optional
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from config import LOG_BUFFER_SIZE, LOG_FLUSH_BATCH_SIZE, LOG_FLUSH_INTERVAL
+from mongo import api_keys_collection_sync, logs_collection_sync
+from models import APILog
+
+logger = logging.getLogger(__name__)
+
+class UsageRecorder:
+    """Buffer API logs and usage counters in memory and write them to MongoDB in batches"""
+
+    def __init__(self, flush_interval: float = LOG_FLUSH_INTERVAL,
+                 batch_size: int = LOG_FLUSH_BATCH_SIZE, buffer_size: int = LOG_BUFFER_SIZE):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        # Failed writes are put back for the next flush; bounded so a long MongoDB outage drops
+        # the oldest logs instead of growing without limit
+        self._logs = deque(maxlen=buffer_size)
+        self._usage: Dict[str, Counter] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._pid = None
+        atexit.register(self.flush)
+
+    def _ensure_started(self) -> None:
+        """Start the flush thread, restarting it in forked worker processes"""
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="usage-recorder", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def record_log(self, log_entry: APILog) -> None:
+        """Queue an API log entry for the next batch insert"""
+        if logs_collection_sync is None:
+            return
+        self._ensure_started()
+        with self._lock:
+            self._logs.append(log_entry.to_dict())
+            pending = len(self._logs)
+        if pending >= self.batch_size:
+            self._wakeup.set()
+
+    def record_usage(self, api_key: str, **increments: int) -> None:
+        """Accumulate counter increments for an API key until the next flush"""
+        if api_keys_collection_sync is None:
+            return
+        self._ensure_started()
+        with self._lock:
+            self._usage.setdefault(api_key, Counter()).update(increments)
+
+    def flush(self) -> None:
+        """Write all buffered logs and counter increments to MongoDB"""
+        with self._lock:
+            logs = list(self._logs)
+            self._logs.clear()
+            usage, self._usage = self._usage, {}
+
+        if logs:
+            try:
+                logs_collection_sync.insert_many(logs, ordered=False)
+            except BulkWriteError as e:
+                # insert_many gave every log an _id, so logs that did land fail as duplicates on retry
+                failed = [logs[error["index"]] for error in e.details.get("writeErrors", [])
+                          if error.get("code") != 11000]
+                self._requeue_logs(failed)
+                logger.error(f"Error writing {len(failed)} of {len(logs)} API logs, retrying next flush: {e}")
+            except Exception as e:
+                self._requeue_logs(logs)
+                logger.error(f"Error writing {len(logs)} API logs, retrying next flush: {e}")
+
+        if usage:
+            keys = list(usage)
+            try:
+                api_keys_collection_sync.bulk_write(
+                    [UpdateOne({"key": key}, {"$inc": dict(usage[key])}) for key in keys],
+                    ordered=False
+                )
+            except BulkWriteError as e:
+                failed = {keys[error["index"]]: usage[keys[error["index"]]] for error in e.details.get("writeErrors", [])}
+                self._requeue_usage(failed)
+                logger.error(f"Error updating usage counters for {len(failed)} API keys, retrying next flush: {e}")
+            except Exception as e:
+                self._requeue_usage(usage)
+                logger.error(f"Error updating usage counters for {len(usage)} API keys, retrying next flush: {e}")
+
+    def _requeue_logs(self, logs: list) -> None:
+        """Put logs that failed to write back ahead of newer ones"""
+        if not logs:
+            return
+        with self._lock:
+            self._logs = deque(logs + list(self._logs), maxlen=self._logs.maxlen)
+
+    def _requeue_usage(self, usage: Dict[str, Counter]) -> None:
+        """Merge counter increments that failed to write into the pending ones"""
+        with self._lock:
+            for key, counts in usage.items():
+                self._usage.setdefault(key, Counter()).update(counts)
+
+# Global instance
+usage_recorder = UsageRecorder()
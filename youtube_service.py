@@ -1,90 +1,111 @@
 import re
-import httpx
 import asyncio
 import logging
 from urllib.parse import urlparse, parse_qs
 from typing import Optional, Dict, Any, Tuple
-from config import EXTERNAL_API_BASE, REQUEST_TIMEOUT
+from config import EXTERNAL_API_BASE, REQUEST_TIMEOUT, VIDEO_INFO_CACHE_TTL, VIDEO_INFO_CACHE_SIZE
+from cache import TTLCache
+from async_runner import SingleFlight
+from http_client import get_async_client, response_json
 from mongo import videos_collection
 from models import VideoInfo
 from telegram_service import telegram_service
 
 logger = logging.getLogger(__name__)
 
+# YouTube watch, youtu.be, embed, shorts and /v/ URLs, or a bare 11-character video ID
+VIDEO_ID_RE = re.compile(
+    r'(?:youtube\.com/watch\?v=|youtu\.be/|youtube\.com/embed/|youtube\.com/shorts/|youtube\.com/v/)([a-zA-Z0-9_-]{11})'
+    r'|^([a-zA-Z0-9_-]{11})$'
+)
+
+# Response labels for each stream type
+STREAM_TYPE_LABELS = {"video": "Video", "audio": "Audio"}
+
 class YouTubeService:
     def __init__(self):
         self.api_base = EXTERNAL_API_BASE
         self.timeout = REQUEST_TIMEOUT
+        # Resolved results by (video_id, stream_type); hits skip MongoDB, Telegram and the external API
+        self.hot_cache = TTLCache(ttl=VIDEO_INFO_CACHE_TTL, maxsize=VIDEO_INFO_CACHE_SIZE)
+        self.external_api_flights = SingleFlight()
     
     def extract_video_id(self, query: str) -> Optional[str]:
         """Extract YouTube video ID from URL or return query if it's already an ID"""
-        # YouTube video ID patterns
-        patterns = [
-            r'(?:youtube\.com/watch\?v=|youtu\.be/|youtube\.com/embed/|youtube\.com/shorts/)([a-zA-Z0-9_-]{11})',
-            r'^[a-zA-Z0-9_-]{11}$'  # Direct video ID
-        ]
-        
-        for pattern in patterns:
-            match = re.search(pattern, query)
-            if match:
-                return match.group(1) if len(match.groups()) > 0 else match.group(0)
-        
+        match = VIDEO_ID_RE.search(query)
+        if match:
+            return match.group(1) or match.group(2)
         return None
     
     def build_youtube_url(self, video_id: str) -> str:
         """Build YouTube URL from video ID"""
         return f"https://www.youtube.com/watch?v={video_id}"
     
+    def _build_response(self, video_info: VideoInfo, stream_type: str, youtube_url: str,
+                        stream_url: str, cached: bool, source: str) -> Dict[str, Any]:
+        """Build the API response for a resolved video"""
+        return {
+            "id": video_info.video_id,
+            "title": video_info.title,
+            "duration": video_info.duration,
+            "link": youtube_url,
+            "channel": video_info.channel,
+            "views": video_info.views,
+            "thumbnail": video_info.thumbnail,
+            "stream_url": stream_url,
+            "stream_type": STREAM_TYPE_LABELS[stream_type],
+            "cached": cached,
+            "source": source
+        }
+    
     async def get_from_cache(self, video_id: str, stream_type: str) -> Optional[Dict[str, Any]]:
         """Get video info from MongoDB cache"""
         try:
+            # One round trip: the video's metadata (preferring this stream type) joined with its Telegram upload
+            pipeline = [
+                {"$match": {"video_id": video_id}},
+                {"$addFields": {"same_stream_type": {"$eq": ["$stream_type", stream_type]}}},
+                {"$sort": {"same_stream_type": -1}},
+                {"$limit": 1},
+                # Only what the response is built from
+                {"$project": {
+                    "_id": 0, "video_id": 1, "stream_type": 1, "same_stream_type": 1,
+                    "title": 1, "duration": 1, "quality": 1, "channel": 1, "views": 1,
+                    "thumbnail": 1, "external_url": 1
+                }},
+                {"$lookup": {
+                    "from": "telegram_files",
+                    "pipeline": [
+                        {"$match": {"video_id": video_id, "stream_type": stream_type}},
+                        {"$limit": 1},
+                        {"$project": {"file_id": 1, "file_path": 1, "file_path_resolved_at": 1}}
+                    ],
+                    "as": "telegram_files"
+                }}
+            ]
+            video_doc = None
+            async for doc in videos_collection.aggregate(pipeline):
+                video_doc = doc
+            
+            if not video_doc:
+                return None
+            
+            video_info = VideoInfo.from_dict(video_doc)
+            youtube_url = self.build_youtube_url(video_id)
+            
             # First check Telegram cache
-            telegram_url = await telegram_service.check_file_exists(video_id, stream_type)
-            if telegram_url:
-                # Get additional info from MongoDB
-                video_doc = await videos_collection.find_one({"video_id": video_id})
-                if video_doc:
-                    video_info = VideoInfo.from_dict(video_doc)
-                    return {
-                        "id": video_id,
-                        "title": video_info.title,
-                        "duration": video_info.duration,
-                        "link": self.build_youtube_url(video_id),
-                        "channel": video_info.channel,
-                        "views": video_info.views,
-                        "thumbnail": video_info.thumbnail,
-                        "stream_url": telegram_url,
-                        "stream_type": "Video" if stream_type == "video" else "Audio",
-                        "cached": True,
-                        "source": "telegram"
-                    }
+            if video_doc["telegram_files"]:
+                telegram_url = await telegram_service.get_file_url(video_doc["telegram_files"][0])
+                if telegram_url:
+                    return self._build_response(video_info, stream_type, youtube_url, telegram_url, True, "telegram")
             
             # Check MongoDB for external URL cache
-            video_doc = await videos_collection.find_one({
-                "video_id": video_id,
-                "stream_type": stream_type
-            })
-            
-            if video_doc:
-                video_info = VideoInfo.from_dict(video_doc)
-                if video_info.external_url:
-                    return {
-                        "id": video_id,
-                        "title": video_info.title,
-                        "duration": video_info.duration,
-                        "link": self.build_youtube_url(video_id),
-                        "channel": video_info.channel,
-                        "views": video_info.views,
-                        "thumbnail": video_info.thumbnail,
-                        "stream_url": video_info.external_url,
-                        "stream_type": "Video" if stream_type == "video" else "Audio",
-                        "cached": True,
-                        "source": "mongodb"
-                    }
+            if video_doc["same_stream_type"] and video_info.external_url:
+                return self._build_response(video_info, stream_type, youtube_url, video_info.external_url, True, "mongodb")
             
             return None
         except Exception as e:
-            logger.error(f"Error getting from cache: {e}")
+            logger.error("Error getting from cache: %s", e)
             return None
     
     async def get_from_external_api(self, video_id: str, stream_type: str) -> Optional[Dict[str, Any]]:
@@ -98,57 +119,44 @@ class YouTubeService:
             else:
                 api_url = f"{self.api_base}/ytmp3"
             
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
-                response = await client.get(api_url, params={"url": youtube_url})
+            response = await get_async_client().get(api_url, params={"url": youtube_url}, timeout=self.timeout)
+            
+            if response.status_code == 200:
+                data = response_json(response)
                 
-                if response.status_code == 200:
-                    data = response.json()
+                if data.get("status") and data.get("result"):
+                    result = data["result"]
                     
-                    if data.get("status") and data.get("result"):
-                        result = data["result"]
-                        
-                        # Create video info object
-                        video_info = VideoInfo(
-                            video_id=video_id,
-                            title=result.get("title", "Unknown Title"),
-                            duration=result.get("duration", "Unknown"),
-                            quality=result.get("quality", "Unknown"),
-                            stream_type=stream_type
-                        )
-                        video_info.external_url = result.get("url")
-                        
-                        # Save to MongoDB
-                        await videos_collection.update_one(
-                            {"video_id": video_id, "stream_type": stream_type},
-                            {"$set": video_info.to_dict()},
-                            upsert=True
+                    # Create video info object
+                    video_info = VideoInfo(
+                        video_id=video_id,
+                        title=result.get("title", "Unknown Title"),
+                        duration=result.get("duration", "Unknown"),
+                        quality=result.get("quality", "Unknown"),
+                        stream_type=stream_type
+                    )
+                    video_info.external_url = result.get("url")
+                    
+                    # Save to MongoDB
+                    await videos_collection.update_one(
+                        {"video_id": video_id, "stream_type": stream_type},
+                        {"$set": video_info.to_dict()},
+                        upsert=True
+                    )
+                    
+                    # Schedule background upload to Telegram
+                    if video_info.external_url:
+                        telegram_service.schedule_background_upload(
+                            video_id, stream_type, video_info.external_url, video_info.title
                         )
-                        
-                        # Schedule background upload to Telegram
-                        if video_info.external_url:
-                            telegram_service.schedule_background_upload(
-                                video_id, stream_type, video_info.external_url, video_info.title
-                            )
-                        
-                        return {
-                            "id": video_id,
-                            "title": video_info.title,
-                            "duration": video_info.duration,
-                            "link": youtube_url,
-                            "channel": video_info.channel,
-                            "views": video_info.views,
-                            "thumbnail": video_info.thumbnail,
-                            "stream_url": video_info.external_url,
-                            "stream_type": "Video" if stream_type == "video" else "Audio",
-                            "cached": False,
-                            "source": "external_api"
-                        }
-                
-                logger.error(f"External API error: {response.status_code} - {response.text}")
-                return None
-                
+                    
+                    return self._build_response(video_info, stream_type, youtube_url, video_info.external_url, False, "external_api")
+            
+            logger.error("External API error: %s - %s", response.status_code, response.text)
+            return None
+            
         except Exception as e:
-            logger.error(f"Error getting from external API: {e}")
+            logger.error("Error getting from external API: %s", e)
             return None
     
     async def get_video_info(self, query: str, video: bool = False) -> Optional[Dict[str, Any]]:
@@ -160,18 +168,27 @@ class YouTubeService:
                 return None
             
             stream_type = "video" if video else "audio"
+            cache_key = (video_id, stream_type)
+            
+            # Recently resolved in this process
+            hot_result = self.hot_cache.get(cache_key)
+            if hot_result:
+                return dict(hot_result, cached=True)
             
             # Check cache first (Telegram and MongoDB)
-            cached_result = await self.get_from_cache(video_id, stream_type)
-            if cached_result:
-                return cached_result
+            result = await self.get_from_cache(video_id, stream_type)
+            if not result:
+                # Fallback to external API, shared with concurrent requests for the same video
+                result = await self.external_api_flights.do(
+                    cache_key, lambda: self.get_from_external_api(video_id, stream_type)
+                )
             
-            # Fallback to external API
-            external_result = await self.get_from_external_api(video_id, stream_type)
-            return external_result
+            if result and result.get("stream_url"):
+                self.hot_cache[cache_key] = dict(result)
+            return result
             
         except Exception as e:
-            logger.error(f"Error in get_video_info: {e}")
+            logger.error("Error in get_video_info: %s", e)
             return None
 
 # Global instance
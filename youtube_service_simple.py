@@ -1,10 +1,15 @@
+import re
 import httpx
 import logging
-import asyncio
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, Iterator, List, Tuple
+from config import (STREAM_CHUNK_SIZE, STREAM_MAX_CONNECTIONS, STREAM_MAX_KEEPALIVE,
+                    VIDEO_INFO_CACHE_TTL, VIDEO_INFO_CACHE_SIZE, VIDEO_CACHE_MISS_TTL)
+from cache import TTLCache
 from models import VideoInfo
-from mongo import videos_collection_sync, videos_collection
+from mongo import videos_collection
 from telegram_service import telegram_service
+from http_client import CONNECT_RETRIES, HTTP2_AVAILABLE, get_async_client, response_json
+from async_runner import SingleFlight
 
 logger = logging.getLogger(__name__)
 
@@ -13,73 +18,168 @@ EXTERNAL_API_BASE = "https://jerrycoder.oggyapi.workers.dev"
 YTMP4_ENDPOINT = f"{EXTERNAL_API_BASE}/ytmp4"
 YTMP3_ENDPOINT = f"{EXTERNAL_API_BASE}/ytmp3"
 
+# Request URLs up to the video ID, with the watch URL already percent-encoded. Parsed video IDs
+# only contain URL-safe characters, so they are appended as-is.
+EXTERNAL_API_URL_PREFIXES = {
+    "video": f"{YTMP4_ENDPOINT}?url=https%3A%2F%2Fyoutube.com%2Fwatch%3Fv%3D",
+    "audio": f"{YTMP3_ENDPOINT}?url=https%3A%2F%2Fyoutube.com%2Fwatch%3Fv%3D"
+}
+
+# Shared pooled client for media streaming so CDN connections are reused across request threads
+STREAM_CLIENT = httpx.Client(
+    timeout=httpx.Timeout(30.0, connect=5.0, pool=5.0),
+    transport=httpx.HTTPTransport(
+        http2=HTTP2_AVAILABLE,
+        limits=httpx.Limits(
+            max_connections=STREAM_MAX_CONNECTIONS,
+            max_keepalive_connections=STREAM_MAX_KEEPALIVE,
+            keepalive_expiry=60
+        ),
+        retries=CONNECT_RETRIES
+    ),
+    # Media is already compressed, and identity keeps Range offsets and lengths in media bytes
+    headers={"Accept-Encoding": "identity"}
+)
+
+# Upstream response headers passed through to clients so Range requests and seeking work;
+# the body is relayed undecoded, so its encoding and length are forwarded as-is
+FORWARDED_STREAM_HEADERS = ("Content-Type", "Content-Length", "Content-Encoding", "Content-Range",
+                            "Accept-Ranges", "Last-Modified", "ETag")
+
+# A bare 11-character video ID, checked first since it is a single anchored match
+BARE_VIDEO_ID_RE = re.compile(r'[a-zA-Z0-9_-]{11}')
+
+# YouTube watch, youtu.be, embed, shorts and /v/ URLs
+VIDEO_URL_RE = re.compile(
+    r'(?:youtube\.com/(?:watch\?v=|embed/|shorts/|v/)|youtu\.be/)([a-zA-Z0-9_-]{11})'
+)
+
+# Fixed fields of the response for a Telegram hit that has no MongoDB metadata, keyed by stream type;
+# copied per request with the video ID and file URL filled in
+TELEGRAM_CACHED_RESPONSES = {
+    stream_type: {
+        "stream_type": stream_type,
+        "status": True,
+        "telegram_cached": True,
+        "title": title
+    }
+    for stream_type, title in (("video", "Telegram Cached Video"), ("audio", "Telegram Cached Audio"))
+}
+
+# A stored video is returned as the API response, so only the internal _id is left out
+VIDEO_RESPONSE_PROJECTION = {"_id": 0}
+
+# External API requests go through the shared async client with these per-request settings
+EXTERNAL_API_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+}
+EXTERNAL_API_TIMEOUT = 10.0
+
 class YouTubeService:
     def __init__(self):
-        self.client = httpx.Client(
-            timeout=10.0,
-            headers={
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
-            }
-        )
+        # Resolved responses, and videos known to be absent from MongoDB, by (video_id, stream_type)
+        self.results = TTLCache(ttl=VIDEO_INFO_CACHE_TTL, maxsize=VIDEO_INFO_CACHE_SIZE)
+        self.cache_misses = TTLCache(ttl=VIDEO_CACHE_MISS_TTL, maxsize=VIDEO_INFO_CACHE_SIZE)
+        # Concurrent requests for a video that isn't cached yet share one resolve
+        self.resolve_flights = SingleFlight()
+    
+    async def _probe_cache(self, video_id: str, stream_type: str) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+        """Look up cached metadata and the Telegram upload record for a video with one aggregation"""
+        if videos_collection is None or (video_id, stream_type) in self.cache_misses:
+            return None, None
+        
+        match = {"$match": {"video_id": video_id, "stream_type": stream_type}}
+        pipeline = [
+            match,
+            {"$limit": 1},
+            {"$project": VIDEO_RESPONSE_PROJECTION},
+            {"$unionWith": {
+                "coll": "telegram_files",
+                "pipeline": [
+                    match,
+                    {"$limit": 1},
+                    {"$project": {"file_id": 1, "file_path": 1, "file_path_resolved_at": 1}}
+                ]
+            }}
+        ]
+        
+        cached_video = None
+        telegram_file = None
+        try:
+            async for doc in videos_collection.aggregate(pipeline):
+                if "video_id" in doc:
+                    cached_video = doc
+                else:
+                    telegram_file = doc
+        except Exception as e:
+            logger.warning("Could not read cache for %s (%s): %s", video_id, stream_type, e)
+            return None, None
+        
+        if cached_video is None and telegram_file is None:
+            self.cache_misses[(video_id, stream_type)] = True
+        return cached_video, telegram_file
+    
+    async def get_video_info(self, video_id: str, stream_type: str = "video") -> Optional[Dict[str, Any]]:
+        """Get video information, reusing responses resolved in this process within the last few minutes"""
+        # Malformed input would only cost MongoDB and external API round trips that can't succeed
+        if stream_type not in EXTERNAL_API_URL_PREFIXES or not BARE_VIDEO_ID_RE.fullmatch(video_id):
+            logger.debug("Rejecting lookup for invalid video %r (%s)", video_id, stream_type)
+            return None
+        
+        key = (video_id, stream_type)
+        result = self.results.get(key)
+        if result is None:
+            result = await self.resolve_flights.do(key, lambda: self._resolve_video_info(video_id, stream_type))
+            if result:
+                self.results[key] = result
+        return result
     
-    def get_video_info(self, video_id: str, stream_type: str = "video") -> Optional[Dict[str, Any]]:
+    async def _resolve_video_info(self, video_id: str, stream_type: str) -> Optional[Dict[str, Any]]:
         """Get video information with Telegram-first caching and smart API integration"""
         try:
+            # Fetch the MongoDB metadata and the Telegram upload record in a single round trip
+            cached_video, telegram_file = await self._probe_cache(video_id, stream_type)
+            
             # Step 1: First Priority - Check Telegram for existing file (your idea!)
             if telegram_service.bot:
-                logger.info(f"Checking Telegram first for {video_id} ({stream_type})")
-                telegram_url = telegram_service.check_file_exists_sync(video_id, stream_type)
+                logger.debug("Checking Telegram first for %s (%s)", video_id, stream_type)
+                telegram_url = None
+                if telegram_file:
+                    # Reuses a fresh stored path; Telegram is only asked once it may have expired
+                    telegram_url = await telegram_service.get_file_url(telegram_file)
                 if telegram_url:
-                    logger.info(f"🎯 FOUND in Telegram! Using file for {video_id} ({stream_type}): {telegram_url}")
+                    logger.debug("Found in Telegram, using file for %s (%s)", video_id, stream_type)
                     
                     # Also check if we have metadata in MongoDB
-                    if videos_collection_sync is not None:
-                        cached_video = videos_collection_sync.find_one({
-                            "video_id": video_id,
-                            "stream_type": stream_type
-                        })
-                        if cached_video:
-                            cached_video['url'] = telegram_url
-                            cached_video['telegram_cached'] = True
-                            cached_video.pop('_id', None)
-                            return cached_video
+                    if cached_video:
+                        cached_video['url'] = telegram_url
+                        cached_video['telegram_cached'] = True
+                        return cached_video
                     
                     # Create basic response with Telegram URL
-                    return {
-                        "video_id": video_id,
-                        "stream_type": stream_type,
-                        "status": True,
-                        "url": telegram_url,
-                        "telegram_cached": True,
-                        "title": f"Telegram Cached {stream_type.title()}"
-                    }
+                    return dict(TELEGRAM_CACHED_RESPONSES[stream_type], video_id=video_id, url=telegram_url)
                 else:
-                    logger.info(f"NOT found in Telegram for {video_id} ({stream_type})")
+                    logger.debug("Not found in Telegram for %s (%s)", video_id, stream_type)
             else:
-                logger.info(f"Telegram bot status: token={bool(telegram_service.bot_token)}, channel={bool(telegram_service.channel_id)}, bot={bool(telegram_service.bot)}")
+                logger.debug("Telegram bot status: token=%s, channel=%s, bot=%s",
+                             bool(telegram_service.bot_token), bool(telegram_service.channel_id), bool(telegram_service.bot))
             
             # Step 2: Check MongoDB cache as fallback (not primary anymore)
-            if videos_collection_sync is not None:
-                cached_video = videos_collection_sync.find_one({
-                    "video_id": video_id,
-                    "stream_type": stream_type
-                })
-                
-                if cached_video:
-                    logger.info(f"Found in MongoDB cache for {video_id} ({stream_type}) - but no Telegram file")
-                    cached_video.pop('_id', None)
-                    return cached_video
+            if cached_video:
+                logger.info("Found in MongoDB cache for %s (%s) - but no Telegram file", video_id, stream_type)
+                return cached_video
             
             # Step 3: Not in cache, fetch from external API
-            endpoint = YTMP4_ENDPOINT if stream_type == "video" else YTMP3_ENDPOINT
-            params = {"url": f"https://youtube.com/watch?v={video_id}"}
+            logger.info("Requesting %s for video_id: %s from external API", stream_type, video_id)
             
-            logger.info(f"Requesting {stream_type} for video_id: {video_id} from external API")
-            
-            response = self.client.get(endpoint, params=params)
+            response = await get_async_client().get(
+                EXTERNAL_API_URL_PREFIXES[stream_type] + video_id,
+                headers=EXTERNAL_API_HEADERS, timeout=EXTERNAL_API_TIMEOUT
+            )
             if response.status_code == 200:
-                data = response.json()
-                logger.debug(f"Third party API response: {data}")
+                data = response_json(response)
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Third party API response: %r", data)
                 
                 if data.get("status") == True:
                     # Normalize response structure
@@ -104,105 +204,92 @@ class YouTubeService:
                         video_data["stream_type"] = stream_type
                     
                     # Step 4: Save to MongoDB cache
-                    if videos_collection_sync is not None:
+                    if videos_collection is not None:
                         try:
-                            videos_collection_sync.insert_one(video_data.copy())
-                            logger.info(f"Saved video {video_id} ({stream_type}) to MongoDB cache")
+                            # Upsert on the lookup key: no copy is needed (the document isn't given an _id in
+                            # place) and a concurrent worker that got there first isn't duplicated
+                            await videos_collection.update_one(
+                                {"video_id": video_id, "stream_type": stream_type},
+                                {"$setOnInsert": video_data},
+                                upsert=True
+                            )
+                            # The video is in MongoDB now, even if its results entry is evicted early
+                            self.cache_misses.pop((video_id, stream_type), None)
+                            logger.info("Saved video %s (%s) to MongoDB cache", video_id, stream_type)
                         except Exception as e:
-                            logger.warning(f"Could not save to MongoDB: {e}")
+                            logger.warning("Could not save to MongoDB: %s", e)
                     
                     # Step 5: Upload to Telegram if bot is configured (YOUR IDEA!)
                     if telegram_service.bot and video_data.get('url') and video_data.get('title'):
-                        logger.info(f"Starting Telegram upload for {video_id} ({stream_type}) as per your idea!")
-                        try:
-                            # Create a new thread for async upload since Flask doesn't have event loop
-                            import threading
-                            
-                            def upload_in_background():
-                                try:
-                                    # More robust async handling
-                                    import asyncio
-                                    import sys
-                                    
-                                    if sys.platform == "win32":
-                                        asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
-                                    
-                                    asyncio.run(telegram_service.upload_file_background(
-                                        video_id, 
-                                        stream_type, 
-                                        video_data['url'], 
-                                        video_data['title']
-                                    ))
-                                    logger.info(f"✅ Telegram upload completed for {video_id} ({stream_type})")
-                                except Exception as e:
-                                    logger.error(f"❌ Background Telegram upload failed for {video_id}: {e}")
-                                    import traceback
-                                    logger.error(f"Full traceback: {traceback.format_exc()}")
-                            
-                            # Start background thread
-                            upload_thread = threading.Thread(target=upload_in_background, daemon=True)
-                            upload_thread.start()
-                            logger.info(f"Started Telegram upload thread for {video_id} ({stream_type}) - following your caching strategy!")
-                        except Exception as e:
-                            logger.warning(f"Could not schedule Telegram upload: {e}")
+                        logger.debug("Scheduling Telegram upload for %s (%s)", video_id, stream_type)
+                        # Runs on this event loop alongside requests, de-duplicated per video
+                        telegram_service.schedule_background_upload(
+                            video_id, stream_type, video_data['url'], video_data['title']
+                        )
                     else:
-                        logger.info(f"Telegram upload skipped for {video_id} ({stream_type}) - Bot configured: {bool(telegram_service.bot)}, URL: {bool(video_data.get('url'))}, Title: {bool(video_data.get('title'))}")
+                        logger.debug("Telegram upload skipped for %s (%s) - Bot configured: %s, URL: %s, Title: %s", video_id, stream_type,
+                                     bool(telegram_service.bot), bool(video_data.get('url')), bool(video_data.get('title')))
                     
                     return video_data
                 else:
-                    logger.error(f"API returned error: {data}")
+                    logger.error("API returned error: %s", data)
                     return None
             else:
-                logger.error(f"HTTP error {response.status_code}: {response.text}")
+                logger.error("HTTP error %s: %s", response.status_code, response.text)
                 return None
                     
         except httpx.TimeoutException:
-            logger.error(f"Timeout while requesting {stream_type} for video_id: {video_id}")
+            logger.error("Timeout while requesting %s for video_id: %s", stream_type, video_id)
             return None
         except Exception as e:
-            logger.error(f"Error getting video info: {e}")
+            logger.error("Error getting video info: %s", e)
             return None
     
     
-    def get_video_stream(self, video_id: str, quality: str = "720p") -> Optional[Dict[str, Any]]:
+    async def get_video_stream(self, video_id: str, quality: str = "720p") -> Optional[Dict[str, Any]]:
         """Get video stream URL"""
-        return self.get_video_info(video_id, "video")
+        return await self.get_video_info(video_id, "video")
     
-    def get_audio_stream(self, video_id: str, quality: str = "128") -> Optional[Dict[str, Any]]:
+    async def get_audio_stream(self, video_id: str, quality: str = "128") -> Optional[Dict[str, Any]]:
         """Get audio stream URL"""  
-        return self.get_video_info(video_id, "audio")
+        return await self.get_video_info(video_id, "audio")
     
-    def stream_content(self, url: str, chunk_size: int = 1024*1024):
-        """Stream content from URL in chunks"""
+    def open_stream(self, url: str, range_header: Optional[str] = None) -> Optional[httpx.Response]:
+        """Open an upstream media stream; the caller must close the returned response"""
         try:
-            with self.client.stream('GET', url) as response:
-                if response.status_code == 200:
-                    for chunk in response.iter_bytes(chunk_size):
-                        yield chunk
-                else:
-                    logger.error(f"Failed to stream content: {response.status_code}")
+            request = STREAM_CLIENT.build_request('GET', url, headers={"Range": range_header} if range_header else None)
+            response = STREAM_CLIENT.send(request, stream=True)
         except Exception as e:
-            logger.error(f"Error streaming content: {e}")
+            logger.error("Error opening stream: %s", e)
+            return None
+        
+        if response.status_code not in (200, 206):
+            logger.error("Failed to stream content: %s", response.status_code)
+            response.close()
+            return None
+        return response
+    
+    def stream_headers(self, response: httpx.Response) -> Dict[str, str]:
+        """Upstream headers to forward to the client"""
+        return {name: response.headers[name] for name in FORWARDED_STREAM_HEADERS if name in response.headers}
+    
+    def iter_stream(self, response: httpx.Response, chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+        """Relay an open stream's body, closing the upstream response when done"""
+        try:
+            # Raw chunks skip decompression and re-chunking; clients decode per Content-Encoding
+            for chunk in response.iter_raw(chunk_size):
+                yield chunk
+        except Exception as e:
+            logger.error("Error streaming content: %s", e)
+        finally:
+            response.close()
     
     def parse_video_id(self, url: str) -> Optional[str]:
         """Extract video ID from YouTube URL"""
-        import re
-        
-        patterns = [
-            r'(?:youtube\.com/watch\?v=|youtu\.be/|youtube\.com/embed/)([a-zA-Z0-9_-]+)',
-            r'youtube\.com/v/([a-zA-Z0-9_-]+)',
-        ]
-        
-        for pattern in patterns:
-            match = re.search(pattern, url)
-            if match:
-                return match.group(1)
-        
-        # If no pattern matches, assume it's already a video ID
-        if re.match(r'^[a-zA-Z0-9_-]{11}$', url):
+        if BARE_VIDEO_ID_RE.fullmatch(url):
             return url
-            
-        return None
+        match = VIDEO_URL_RE.search(url)
+        return match.group(1) if match else None
 
 # Create global instance
 youtube_service = YouTubeService()
\ No newline at end of file